@@ -0,0 +1,106 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from etl.db import _copy_value
+from etl.transform import sales_measures, to_fixed
+
+EPOCH = datetime(1970, 1, 1)
+CENT4 = Decimal("0.0001")
+
+# Benchmark: laço escalar por linha (implementação anterior de load_fact_sales, com float)
+# x transformação colunar em lote (etl.transform.sales_measures, ponto fixo exato).
+
+def synthetic_rows(n, seed=42):
+    rnd = random.Random(seed)
+    catalog = [Decimal(rnd.randrange(50, 200000)).scaleb(-2) for _ in range(504)]  # ~ production.product
+    rows, costs = [], []
+    for _ in range(n):
+        orderdate = datetime(2011, 5, 31) + timedelta(days=rnd.randrange(0, 1100))
+        qty = rnd.randint(1, 30)
+        price = Decimal(rnd.randrange(100, 350000)).scaleb(-2)
+        subtotal = (qty * price).quantize(Decimal("0.0001"))
+        share = Decimal(rnd.random())
+        row = {
+            "orderqty": qty,
+            "line_subtotal_calc": subtotal,
+            "tax_alloc": subtotal * Decimal("0.08") * share,
+            "freight_alloc": subtotal * Decimal("0.025") * share,
+            "orderdate": orderdate,
+            "duedate": orderdate + timedelta(days=12),
+            "shipdate": orderdate + timedelta(days=rnd.randint(5, 14)) if rnd.random() > 0.01 else None,
+        }
+        # colunas auxiliares que SALES_EXTRACT_SQL entrega prontas (ponto fixo e epoch)
+        row["line_subtotal_fx"] = to_fixed(row["line_subtotal_calc"])
+        row["total_due_fx"] = to_fixed(row["line_subtotal_calc"] + row["tax_alloc"] + row["freight_alloc"])
+        for col in ("orderdate", "duedate", "shipdate"):
+            row[col + "_ts"] = int((row[col] - EPOCH).total_seconds()) if row[col] else None
+        rows.append(row)
+        costs.append(rnd.choice(catalog))
+    return rows, costs
+
+def per_row(rows, costs):
+    out = []
+    for r, standard_cost in zip(rows, costs):
+        standard_cost_amount = float(standard_cost or 0) * float(r["orderqty"] or 0)
+        line_subtotal = float(r["line_subtotal_calc"] or 0)
+        tax_alloc = float(r["tax_alloc"] or 0)
+        freight_alloc = float(r["freight_alloc"] or 0)
+        total_due_line = line_subtotal + tax_alloc + freight_alloc
+        gross_margin_amount = line_subtotal - standard_cost_amount
+        shipping_days = None
+        if r["orderdate"] and r["shipdate"]:
+            shipping_days = (r["shipdate"] - r["orderdate"]).days
+        on_time_delivery = None
+        if r["duedate"] and r["shipdate"]:
+            on_time_delivery = r["shipdate"] <= r["duedate"]
+        out.append((total_due_line, standard_cost_amount, gross_margin_amount, shipping_days, on_time_delivery))
+    return out
+
+def batched(rows, costs, batch_size):
+    out = []
+    for i in range(0, len(rows), batch_size):
+        m = sales_measures(rows[i:i + batch_size], costs[i:i + batch_size])
+        out.extend(zip(m["total_due_line"], m["standard_cost_amount"], m["gross_margin_amount"],
+                       m["shipping_days"], m["on_time_delivery"]))
+    return out
+
+def serialized(fn, *args):
+    # inclui a serialização para o texto do COPY, custo que ambos os caminhos pagam no loader
+    out = fn(*args)
+    for row in out:
+        "\t".join(_copy_value(v) for v in row)
+    return out
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = serialized(fn, *args)
+    return result, time.perf_counter() - start
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark da transformação de fact_sales (por linha x colunar)")
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--batch-size", type=int, default=5000)
+    args = ap.parse_args()
+
+    rows, costs = synthetic_rows(args.rows)
+    scalar, t_scalar = timed(per_row, rows, costs)
+    vector, t_vector = timed(batched, rows, costs, args.batch_size)
+
+    # total_due_line exato (soma dos componentes sem arredondar), com um único ROUND(..., 4) HALF_UP final
+    exact = [(r["line_subtotal_calc"] + r["tax_alloc"] + r["freight_alloc"]).quantize(CENT4, ROUND_HALF_UP)
+             for r in rows]
+    # precisão: caminho float com o mesmo arredondamento final (só o erro do float)
+    float_drift = sum(1 for a, e in zip(scalar, exact) if Decimal(a[0]).quantize(CENT4, ROUND_HALF_UP) != e)
+    # colunar: total arredondado uma vez na extração (total_due_fx)
+    rounding_drift = sum(1 for b, e in zip(vector, exact) if b[0] != e)
+    print(f"linhas: {args.rows}  lote: {args.batch_size}")
+    print(f"por linha (float): {t_scalar:8.3f}s  {args.rows / t_scalar:12,.0f} linhas/s")
+    print(f"colunar (exato):   {t_vector:8.3f}s  {args.rows / t_vector:12,.0f} linhas/s")
+    print(f"speedup: {t_scalar / t_vector:.2f}x")
+    print(f"total_due_line x total exato arredondado uma vez: float {float_drift} linhas (precisão), "
+          f"colunar {rounding_drift} linhas")
+
+if __name__ == "__main__":
+    main()
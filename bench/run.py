@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import date, datetime, timezone
+from functools import partial
+from pathlib import Path
+import psycopg2
+from etl import db, metrics, main as etl_main
+from etl.load_dim_date import load_dim_date, source_date_range
+from etl.load_dimensions import DIMENSION_LOADERS
+from etl.load_fact_sales import load_fact_sales_partitioned, load_fact_sales_ranges
+from etl.load_fact_purchases import load_fact_purchases
+from etl.load_fact_inventory_snapshot import load_inventory_snapshot
+from . import synthetic
+
+# Benchmark do ETL contra um OLTP sintético (bench.synthetic) e um DW descartável.
+# Alvos: full_load (DW recriado do zero), cada loader isolado (sobre o DW já carregado) e
+# daily_incremental (após acrescentar um dia de movimento ao OLTP).
+# Cada medição vira uma linha JSON em --results (revisão do git, escala, tempos e etapas de etl.metrics),
+# comparada na saída com a medição anterior do mesmo alvo e escala.
+#
+#   BENCH_OLTP_DSN=... BENCH_DW_DSN=... python -m bench.run --scale 10 --build
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_RESULTS = Path(__file__).resolve().parent / "results.jsonl"
+TARGETS = ("full_load", "loaders", "daily_incremental")
+
+def isolated_loaders():
+    """Loaders idempotentes, medidos um a um sobre o DW já carregado (dimensões relidas por inteiro)."""
+    return [
+        ("dim_date", lambda: load_dim_date(*source_date_range())),
+        *((name, partial(loader, incremental=False)) for name, loader in DIMENSION_LOADERS),
+        ("fact_sales_partitioned", load_fact_sales_partitioned),
+        ("fact_sales_ranges", load_fact_sales_ranges),
+        ("fact_purchases", lambda: load_fact_purchases(truncate=True)),
+        ("fact_inventory_snapshot", lambda: load_inventory_snapshot(date.today())),
+    ]
+
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev + ("-dirty" if dirty else "")
+
+def reset_dw(dsn):
+    """Recria o schema dw a partir de sql/*.sql (somente no DW de benchmark)."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS dw CASCADE")
+            for path in sorted((ROOT / "sql").glob("*.sql")):
+                cur.execute(path.read_text(encoding="utf-8"))
+    finally:
+        conn.close()
+
+def measure(target, fn):
+    with metrics.run(f"bench.{target}") as run:
+        fn()
+    return run.report()
+
+def load_results(path):
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def previous(history, scale, target):
+    for r in reversed(history):
+        if r["scale"] == scale and r["target"] == target and r["status"] == "success":
+            return r
+    return None
+
+def print_result(rec, prev):
+    delta = ""
+    if prev and prev["seconds"]:
+        delta = f"{(rec['seconds'] - prev['seconds']) / prev['seconds']:+8.1%} vs {prev['revision']}"
+    print(f"{rec['target']:<32} {rec['seconds']:9.2f}s {rec['rows_out']:>12,} linhas "
+          f"{rec['round_trips']:>10,} idas  {delta}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark do ETL em um AdventureWorks sintético")
+    ap.add_argument("--oltp-dsn", default=os.getenv("BENCH_OLTP_DSN"), help="OLTP sintético (BENCH_OLTP_DSN)")
+    ap.add_argument("--dw-dsn", default=os.getenv("BENCH_DW_DSN"), help="DW descartável (BENCH_DW_DSN)")
+    ap.add_argument("--scale", type=float, default=1.0, help="fator de escala do OLTP (1, 10, 100...)")
+    ap.add_argument("--build", action="store_true", help="(re)gera o OLTP sintético antes de medir")
+    ap.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    ap.add_argument("--results", type=Path, default=DEFAULT_RESULTS)
+    args = ap.parse_args()
+
+    # DSNs explícitos: o benchmark recria o schema dw e altera o OLTP, nunca usa os bancos do ETL
+    if not args.oltp_dsn or not args.dw_dsn:
+        ap.error("informe --oltp-dsn/--dw-dsn (ou BENCH_OLTP_DSN/BENCH_DW_DSN)")
+    db.OLTP_DSN, db.DW_DSN = args.oltp_dsn, args.dw_dsn
+
+    if args.build:
+        print("volumes:", synthetic.build(args.oltp_dsn, args.scale))
+
+    runs = []
+    if "full_load" in args.targets:
+        reset_dw(args.dw_dsn)
+        runs.append(("full_load", etl_main.full_load().report()))
+    if "loaders" in args.targets:
+        for name, loader in isolated_loaders():
+            runs.append((f"loader.{name}", measure(f"loader.{name}", loader)))
+    if "daily_incremental" in args.targets:
+        synthetic.append_day(args.oltp_dsn, args.scale)
+        runs.append(("daily_incremental", etl_main.daily_incremental().report()))
+
+    history = load_results(args.results)
+    revision = git_revision()
+    at = datetime.now(timezone.utc).isoformat()
+    args.results.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as f:
+        for target, report in runs:
+            rec = {"at": at, "revision": revision, "scale": args.scale, "target": target,
+                   "python": sys.version.split()[0],
+                   **{k: report[k] for k in ("status", "seconds", "rows_in", "rows_out", "round_trips",
+                                             "peak_rss_kb", "stages")}}
+            f.write(json.dumps(rec, default=str) + "\n")
+            print_result(rec, previous(history, args.scale, target))
+
+if __name__ == "__main__":
+    main()
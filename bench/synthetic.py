@@ -0,0 +1,477 @@
+import argparse
+import math
+import psycopg2
+
+# Gerador de um OLTP AdventureWorks sintético (apenas as tabelas/colunas lidas pelo ETL).
+# Volumes base = AdventureWorks 2014; scale multiplica pessoas/clientes/cartões/pedidos e
+# sqrt(scale) produtos e fornecedores (catálogos crescem mais devagar que o movimento).
+# Distribuições: produtos e clientes com cauda longa (poucos concentram a maior parte das linhas),
+# pedidos crescendo ao longo do período, ~3,8 linhas por pedido, descontos raros.
+# Tudo é gerado no servidor (generate_series), com semente fixa: mesma escala -> mesmos dados.
+
+SCHEMAS = ("sales", "purchasing", "production", "person")
+MARKER = "synthetic"  # COMMENT ON SCHEMA: só recria schemas criados por este gerador
+
+BASE = {
+    "persons": 19119,
+    "stores": 701,
+    "creditcards": 19118,
+    "orders": 31465,
+    "purchase_orders": 4012,
+    "products": 504,
+    "vendors": 104,
+}
+
+FIRST_ORDER_DATE = "2011-05-31"
+ORDER_DAYS = 1127
+FIRST_PURCHASE_DATE = "2011-04-16"
+PURCHASE_DAYS = 1256
+
+DDL = """
+CREATE SCHEMA person;
+CREATE SCHEMA production;
+CREATE SCHEMA purchasing;
+CREATE SCHEMA sales;
+
+CREATE TABLE person.person (
+  businessentityid int PRIMARY KEY,
+  firstname text NOT NULL,
+  lastname text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE person.emailaddress (
+  businessentityid int NOT NULL,
+  emailaddressid serial,
+  emailaddress text,
+  modifieddate timestamp NOT NULL DEFAULT now(),
+  PRIMARY KEY (businessentityid, emailaddressid)
+);
+CREATE TABLE person.personphone (
+  businessentityid int NOT NULL,
+  phonenumber text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now(),
+  PRIMARY KEY (businessentityid, phonenumber)
+);
+
+CREATE TABLE production.productcategory (
+  productcategoryid int PRIMARY KEY,
+  name text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE production.productsubcategory (
+  productsubcategoryid int PRIMARY KEY,
+  productcategoryid int NOT NULL,
+  name text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE production.product (
+  productid int PRIMARY KEY,
+  name text NOT NULL,
+  productnumber text NOT NULL,
+  color text,
+  size text,
+  style text,
+  productsubcategoryid int,
+  standardcost numeric(19,4) NOT NULL,
+  listprice numeric(19,4) NOT NULL,
+  discontinueddate timestamp,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE production.location (
+  locationid int PRIMARY KEY,
+  name text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE production.productinventory (
+  productid int NOT NULL,
+  locationid int NOT NULL,
+  quantity int NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now(),
+  PRIMARY KEY (productid, locationid)
+);
+
+CREATE TABLE purchasing.vendor (
+  businessentityid int PRIMARY KEY,
+  name text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE purchasing.shipmethod (
+  shipmethodid int PRIMARY KEY,
+  name text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE purchasing.purchaseorderheader (
+  purchaseorderid int PRIMARY KEY,
+  vendorid int NOT NULL,
+  orderdate timestamp NOT NULL,
+  shipdate timestamp,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE purchasing.purchaseorderdetail (
+  purchaseorderid int NOT NULL,
+  purchaseorderdetailid int PRIMARY KEY,
+  productid int NOT NULL,
+  orderqty int NOT NULL,
+  unitprice numeric(19,4) NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+
+CREATE TABLE sales.salesterritory (
+  territoryid int PRIMARY KEY,
+  name text NOT NULL,
+  countryregioncode text NOT NULL,
+  "group" text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.salesperson (
+  businessentityid int PRIMARY KEY,
+  territoryid int,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.store (
+  businessentityid int PRIMARY KEY,
+  name text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.customer (
+  customerid int PRIMARY KEY,
+  personid int,
+  storeid int,
+  territoryid int,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.creditcard (
+  creditcardid int PRIMARY KEY,
+  cardtype text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.specialoffer (
+  specialofferid int PRIMARY KEY,
+  description text NOT NULL,
+  discountpct numeric(10,4) NOT NULL,
+  type text NOT NULL,
+  category text NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.specialofferproduct (
+  specialofferid int NOT NULL,
+  productid int NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now(),
+  PRIMARY KEY (specialofferid, productid)
+);
+CREATE TABLE sales.salesorderheader (
+  salesorderid int PRIMARY KEY,
+  salesordernumber text NOT NULL,
+  orderdate timestamp NOT NULL,
+  duedate timestamp NOT NULL,
+  shipdate timestamp,
+  customerid int NOT NULL,
+  salespersonid int,
+  territoryid int,
+  shipmethodid int NOT NULL,
+  creditcardid int,
+  subtotal numeric(19,4) NOT NULL DEFAULT 0,
+  taxamt numeric(19,4) NOT NULL DEFAULT 0,
+  freight numeric(19,4) NOT NULL DEFAULT 0,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE TABLE sales.salesorderdetail (
+  salesorderid int NOT NULL,
+  salesorderdetailid int PRIMARY KEY,
+  orderqty int NOT NULL,
+  productid int NOT NULL,
+  specialofferid int NOT NULL,
+  unitprice numeric(19,4) NOT NULL,
+  unitpricediscount numeric(19,4) NOT NULL DEFAULT 0,
+  linetotal numeric(38,6) NOT NULL,
+  modifieddate timestamp NOT NULL DEFAULT now()
+);
+CREATE INDEX ix_salesorderdetail_order ON sales.salesorderdetail(salesorderid);
+CREATE INDEX ix_purchaseorderdetail_order ON purchasing.purchaseorderdetail(purchaseorderid);
+"""
+
+LOOKUPS = """
+INSERT INTO production.productcategory(productcategoryid, name)
+VALUES (1, 'Bikes'), (2, 'Components'), (3, 'Clothing'), (4, 'Accessories');
+
+INSERT INTO production.productsubcategory(productsubcategoryid, productcategoryid, name)
+SELECT g, 1 + (g - 1) % 4, 'Subcategory ' || g FROM generate_series(1, 37) g;
+
+INSERT INTO production.location(locationid, name)
+SELECT g, 'Location ' || g FROM generate_series(1, 14) g;
+
+INSERT INTO sales.salesterritory(territoryid, name, countryregioncode, "group")
+VALUES (1, 'Northwest', 'US', 'North America'), (2, 'Northeast', 'US', 'North America'),
+       (3, 'Central', 'US', 'North America'), (4, 'Southwest', 'US', 'North America'),
+       (5, 'Southeast', 'US', 'North America'), (6, 'Canada', 'CA', 'North America'),
+       (7, 'France', 'FR', 'Europe'), (8, 'Germany', 'DE', 'Europe'),
+       (9, 'Australia', 'AU', 'Pacific'), (10, 'United Kingdom', 'GB', 'Europe');
+
+INSERT INTO purchasing.shipmethod(shipmethodid, name)
+VALUES (1, 'XRQ - TRUCK GROUND'), (2, 'ZY - EXPRESS'), (3, 'OVERSEAS - DELUXE'),
+       (4, 'OVERNIGHT J-FAST'), (5, 'CARGO TRANSPORT 5');
+
+INSERT INTO sales.specialoffer(specialofferid, description, discountpct, type, category)
+SELECT g,
+       CASE WHEN g = 1 THEN 'No Discount' ELSE 'Offer ' || g END,
+       CASE WHEN g = 1 THEN 0 ELSE round((0.02 + (g % 8) * 0.05)::numeric, 4) END,
+       CASE WHEN g = 1 THEN 'No Discount' ELSE (ARRAY['Volume Discount', 'Seasonal Discount', 'Excess Inventory'])[1 + g % 3] END,
+       CASE WHEN g = 1 THEN 'No Discount' ELSE (ARRAY['Reseller', 'Customer'])[1 + g % 2] END
+FROM generate_series(1, 16) g;
+"""
+
+ENTITIES = """
+INSERT INTO production.product(productid, name, productnumber, color, size, style, productsubcategoryid,
+                               standardcost, listprice, discontinueddate)
+SELECT g, 'Product ' || g, 'PN-' || lpad(g::text, 6, '0'),
+       (ARRAY['Black', 'Red', 'Silver', 'Blue', 'Yellow', NULL])[1 + floor(random() * 6)::int],
+       (ARRAY['S', 'M', 'L', 'XL', NULL])[1 + floor(random() * 5)::int],
+       (ARRAY['U', 'M', 'W', NULL])[1 + floor(random() * 4)::int],
+       CASE WHEN random() < 0.4 THEN NULL ELSE 1 + floor(random() * 37)::int END,
+       cost, round(cost * (1.4 + random()), 4),
+       CASE WHEN random() < 0.05 THEN timestamp '2013-05-30' END
+FROM (SELECT g, round((1 + power(random(), 3) * 2100)::numeric, 4) AS cost
+      FROM generate_series(1, %(products)s) g) p;
+
+-- cada produto em 1 a 3 localizações (a referência a p força a reavaliação do LATERAL por produto)
+INSERT INTO production.productinventory(productid, locationid, quantity)
+SELECT DISTINCT ON (p.productid, l.loc) p.productid, l.loc, floor(random() * 800)::int
+FROM production.product p
+CROSS JOIN LATERAL (SELECT 1 + floor(random() * 14)::int AS loc
+                    FROM generate_series(1, 1 + floor(random() * 3)::int + 0 * p.productid)) l
+ORDER BY p.productid, l.loc;
+
+-- promoção 1 (sem desconto) vale para todos; as demais para ~3%% do catálogo
+INSERT INTO sales.specialofferproduct(specialofferid, productid)
+SELECT 1, productid FROM production.product
+UNION
+SELECT 2 + floor(random() * 15)::int, productid FROM production.product WHERE random() < 0.03;
+
+INSERT INTO person.person(businessentityid, firstname, lastname)
+SELECT g, 'First' || (g %% 997), 'Last' || (g %% 1009) FROM generate_series(1, %(persons)s) g;
+
+INSERT INTO person.emailaddress(businessentityid, emailaddress)
+SELECT businessentityid, 'user' || businessentityid || '@adventure-works.com' FROM person.person;
+
+INSERT INTO person.personphone(businessentityid, phonenumber)
+SELECT businessentityid, '555-' || lpad((businessentityid %% 10000)::text, 4, '0')
+FROM person.person WHERE random() < 0.95;
+
+-- vendedores: as primeiras 17 pessoas
+INSERT INTO sales.salesperson(businessentityid, territoryid)
+SELECT g, CASE WHEN g > 3 THEN 1 + g %% 10 END FROM generate_series(1, 17) g;
+
+INSERT INTO sales.store(businessentityid, name)
+SELECT %(persons)s + g, 'Store ' || g FROM generate_series(1, %(stores)s) g;
+
+INSERT INTO purchasing.vendor(businessentityid, name)
+SELECT %(persons)s + %(stores)s + g, 'Vendor ' || g FROM generate_series(1, %(vendors)s) g;
+
+-- clientes: pessoas (varejo) e lojas (revenda)
+INSERT INTO sales.customer(customerid, personid, storeid, territoryid)
+SELECT g, g, NULL, 1 + floor(random() * 10)::int FROM generate_series(1, %(persons)s) g
+UNION ALL
+SELECT %(persons)s + g, NULL, %(persons)s + g, 1 + floor(random() * 10)::int FROM generate_series(1, %(stores)s) g;
+
+INSERT INTO sales.creditcard(creditcardid, cardtype)
+SELECT g, (ARRAY['SuperiorCard', 'Distinguish', 'ColonialVoice', 'Vista'])[1 + floor(random() * 4)::int]
+FROM generate_series(1, %(creditcards)s) g;
+"""
+
+# Pedidos de venda: %(orders)s pedidos entre %(first_date)s e + %(days)s dias, ids continuando os existentes.
+# power(random(), %(date_skew)s) < 1 concentra os pedidos no fim do período (crescimento das vendas).
+SALES_ORDERS = """
+CREATE TEMP TABLE _new_orders ON COMMIT DROP AS
+SELECT (SELECT COALESCE(max(salesorderid), 43658) FROM sales.salesorderheader)
+         + row_number() OVER (ORDER BY o.orderdate, o.g) AS salesorderid,
+       o.orderdate, o.customerid,
+       (1 + floor(power(random(), 2) * 10))::int AS lines
+FROM (
+  SELECT g,
+         %(first_date)s::timestamp + floor(power(random(), %(date_skew)s) * %(days)s)::int * interval '1 day' AS orderdate,
+         -- cauda longa: lojas (ids altos) compram com frequência, clientes de varejo repetem pouco
+         CASE WHEN random() < 0.12
+              THEN %(persons)s + 1 + floor(power(random(), 1.5) * %(stores)s)::int
+              ELSE 1 + floor(power(random(), 1.3) * %(persons)s)::int END AS customerid
+  FROM generate_series(1, %(orders)s) g
+) o;
+
+INSERT INTO sales.salesorderheader(salesorderid, salesordernumber, orderdate, duedate, shipdate, customerid,
+                                   salespersonid, territoryid, shipmethodid, creditcardid)
+SELECT o.salesorderid, 'SO' || o.salesorderid, o.orderdate, o.orderdate + interval '12 days',
+       CASE WHEN random() < 0.99 THEN o.orderdate + (5 + floor(random() * 10)::int) * interval '1 day' END,
+       o.customerid,
+       CASE WHEN c.storeid IS NOT NULL THEN 1 + floor(random() * 17)::int END,
+       c.territoryid,
+       CASE WHEN c.storeid IS NOT NULL THEN 5 ELSE 1 END,
+       CASE WHEN c.storeid IS NULL OR random() < 0.5 THEN 1 + floor(random() * %(creditcards)s)::int END
+FROM _new_orders o
+JOIN sales.customer c ON c.customerid = o.customerid;
+
+INSERT INTO sales.salesorderdetail(salesorderid, salesorderdetailid, orderqty, productid, specialofferid,
+                                   unitprice, unitpricediscount, linetotal)
+SELECT d.salesorderid,
+       (SELECT COALESCE(max(salesorderdetailid), 0) FROM sales.salesorderdetail)
+         + row_number() OVER (ORDER BY d.salesorderid, d.line),
+       d.orderqty, d.productid, d.specialofferid, d.unitprice, d.discount,
+       round(d.orderqty * d.unitprice * (1 - d.discount), 6)
+FROM (
+  SELECT l.salesorderid, l.line, l.productid, l.orderqty, p.listprice AS unitprice,
+         CASE WHEN l.offer = 1 THEN 0::numeric ELSE so.discountpct END AS discount,
+         l.offer AS specialofferid
+  FROM (
+    SELECT o.salesorderid, s.line,
+           1 + floor(power(random(), 3) * %(products)s)::int AS productid,
+           1 + floor(power(random(), 4) * 30)::int AS orderqty,
+           CASE WHEN random() < 0.02 THEN 2 + floor(random() * 15)::int ELSE 1 END AS offer
+    FROM _new_orders o
+    CROSS JOIN LATERAL generate_series(1, o.lines) AS s(line)
+  ) l
+  JOIN production.product p ON p.productid = l.productid
+  JOIN sales.specialoffer so ON so.specialofferid = l.offer
+) d;
+
+UPDATE sales.salesorderheader h
+   SET subtotal = t.subtotal,
+       taxamt = round(t.subtotal * 0.08, 4),
+       freight = round(t.subtotal * 0.025, 4)
+  FROM (SELECT d.salesorderid, round(sum(d.linetotal), 4) AS subtotal
+          FROM sales.salesorderdetail d
+          JOIN _new_orders o ON o.salesorderid = d.salesorderid
+         GROUP BY d.salesorderid) t
+ WHERE h.salesorderid = t.salesorderid;
+"""
+
+PURCHASE_ORDERS = """
+CREATE TEMP TABLE _new_purchases ON COMMIT DROP AS
+SELECT (SELECT COALESCE(max(purchaseorderid), 0) FROM purchasing.purchaseorderheader)
+         + row_number() OVER (ORDER BY p.orderdate, p.g) AS purchaseorderid,
+       p.orderdate, p.vendorid,
+       (1 + floor(power(random(), 2) * 5))::int AS lines
+FROM (
+  SELECT g,
+         %(first_date)s::timestamp + floor(random() * %(days)s)::int * interval '1 day' AS orderdate,
+         %(persons)s + %(stores)s + 1 + floor(power(random(), 2) * %(vendors)s)::int AS vendorid
+  FROM generate_series(1, %(purchase_orders)s) g
+) p;
+
+INSERT INTO purchasing.purchaseorderheader(purchaseorderid, vendorid, orderdate, shipdate, modifieddate)
+SELECT purchaseorderid, vendorid, orderdate, orderdate + interval '9 days', orderdate + interval '9 days'
+FROM _new_purchases;
+
+-- compras só de ~40%% do catálogo (os demais itens são fabricados)
+INSERT INTO purchasing.purchaseorderdetail(purchaseorderid, purchaseorderdetailid, productid, orderqty,
+                                           unitprice, modifieddate)
+SELECT l.purchaseorderid,
+       (SELECT COALESCE(max(purchaseorderdetailid), 0) FROM purchasing.purchaseorderdetail)
+         + row_number() OVER (ORDER BY l.purchaseorderid, l.line),
+       l.productid, l.orderqty, round(p.standardcost * 0.6, 4), l.orderdate + interval '9 days'
+FROM (
+  SELECT n.purchaseorderid, n.orderdate, s.line,
+         1 + floor(random() * greatest(1, %(products)s * 4 / 10))::int AS productid,
+         (ARRAY[3, 60, 550])[1 + floor(random() * 3)::int] AS orderqty
+  FROM _new_purchases n
+  CROSS JOIN LATERAL generate_series(1, n.lines) AS s(line)
+) l
+JOIN production.product p ON p.productid = l.productid;
+"""
+
+# Movimento de um dia após a última data existente (para medir daily_incremental)
+DAILY_CHANGES = """
+-- ~1% dos produtos muda de preço (nova versão SCD2) e algumas linhas de compra são revisadas
+UPDATE production.product
+   SET listprice = round(listprice * 1.05, 4), modifieddate = now()
+ WHERE random() < 0.01;
+
+UPDATE purchasing.purchaseorderdetail
+   SET orderqty = orderqty + 1, modifieddate = now()
+ WHERE random() < 0.001;
+
+UPDATE production.productinventory
+   SET quantity = greatest(0, quantity - floor(random() * 20)::int), modifieddate = now()
+ WHERE random() < 0.2;
+"""
+
+def volumes(scale):
+    """Volumes por escala: movimento escala linearmente, catálogos com sqrt(scale)."""
+    linear = {k: BASE[k] for k in ("persons", "stores", "creditcards", "orders", "purchase_orders")}
+    v = {k: max(1, round(n * scale)) for k, n in linear.items()}
+    v["products"] = max(40, round(BASE["products"] * math.sqrt(scale)))
+    v["vendors"] = max(5, round(BASE["vendors"] * math.sqrt(scale)))
+    return v
+
+def _check_owned(cur):
+    # nunca apaga um OLTP real: só schemas ausentes ou marcados por este gerador
+    for schema in SCHEMAS:
+        cur.execute("SELECT obj_description(oid, 'pg_namespace') AS d FROM pg_namespace WHERE nspname = %s", (schema,))
+        r = cur.fetchone()
+        if r is not None and not (r[0] or "").startswith(MARKER):
+            raise RuntimeError(f"schema {schema} já existe e não foi criado pelo gerador sintético; abortando")
+
+def build(dsn, scale=1.0, seed=0.42):
+    """(Re)cria os schemas de origem no banco dsn com os volumes de volumes(scale). Retorna os volumes."""
+    v = volumes(scale)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            _check_owned(cur)
+            for schema in SCHEMAS:
+                cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(DDL)
+            for schema in SCHEMAS:
+                cur.execute(f"COMMENT ON SCHEMA {schema} IS %s", (f"{MARKER} scale={scale}",))
+            cur.execute("SELECT setseed(%s)", (seed,))
+            cur.execute(LOOKUPS)
+            cur.execute(ENTITIES, v)
+            cur.execute(SALES_ORDERS, {**v, "first_date": FIRST_ORDER_DATE, "days": ORDER_DAYS, "date_skew": 0.7})
+            cur.execute(PURCHASE_ORDERS, {**v, "first_date": FIRST_PURCHASE_DATE, "days": PURCHASE_DAYS})
+        conn.commit()
+        _analyze(conn)
+    finally:
+        conn.close()
+    return v
+
+def append_day(dsn, scale=1.0, seed=0.24):
+    """Acrescenta o movimento de um dia (pedidos, compras, alterações de cadastro) após a última data."""
+    v = volumes(scale)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            _check_owned(cur)
+            cur.execute("SELECT setseed(%s)", (seed,))
+            cur.execute("SELECT max(orderdate) + interval '1 day' FROM sales.salesorderheader")
+            next_sale = cur.fetchone()[0]
+            cur.execute("SELECT max(orderdate) + interval '1 day' FROM purchasing.purchaseorderheader")
+            next_purchase = cur.fetchone()[0]
+            daily = {**v,
+                     "orders": max(1, v["orders"] // ORDER_DAYS),
+                     "purchase_orders": max(1, v["purchase_orders"] // PURCHASE_DAYS)}
+            cur.execute(SALES_ORDERS, {**daily, "first_date": next_sale, "days": 1, "date_skew": 1})
+            cur.execute(PURCHASE_ORDERS, {**daily, "first_date": next_purchase, "days": 1})
+            cur.execute(DAILY_CHANGES)
+        conn.commit()
+        _analyze(conn)
+    finally:
+        conn.close()
+
+def _analyze(conn):
+    old = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for schema in SCHEMAS:
+                cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s", (schema,))
+                for (table,) in cur.fetchall():
+                    cur.execute(f"ANALYZE {schema}.{table}")
+    finally:
+        conn.autocommit = old
+
+def main():
+    ap = argparse.ArgumentParser(description="Gera um OLTP AdventureWorks sintético em escala")
+    ap.add_argument("dsn", help="banco de destino (schemas sales/purchasing/production/person são recriados)")
+    ap.add_argument("--scale", type=float, default=1.0, help="fator de escala (1, 10, 100...)")
+    args = ap.parse_args()
+    print(build(args.dsn, args.scale))
+
+if __name__ == "__main__":
+    main()
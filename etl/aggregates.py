@@ -0,0 +1,77 @@
+from typing import Iterable
+from .db import set_watermark
+from .partitions import month_bounds
+
+# Manutenção incremental dos agregados de KPI (dw.agg_sales_month, dw.agg_sales_month_territory).
+# Cada mês tocado por uma carga é recalculado por inteiro a partir da sua partição de fact_sales
+# (filtro por faixa de order_date_key -> partition pruning); os demais meses não são lidos.
+# Cada recálculo grava o watermark 'agg_sales_month' na mesma transação: é a versão dos dados lida
+# pelo cache de KPIs (etl.kpi), que assim muda junto com os agregados, qualquer que seja a carga.
+
+def refresh_sales_aggregates(dw_conn, months: Iterable[int], commit: bool = True) -> None:
+    """
+    Recalcula os agregados dos meses (yyyymm) informados, em uma única transação
+    (commit=False: na transação corrente do chamador, p.ex. o checkpoint da carga).
+    """
+    months = sorted(set(months))
+    if not months:
+        return
+    with dw_conn.cursor() as cur:
+        for yyyymm in months:
+            start, end = month_bounds(yyyymm)
+            params = {"year": yyyymm // 100, "month": yyyymm % 100, "start": start, "end": end}
+            cur.execute("DELETE FROM dw.agg_sales_month WHERE year = %(year)s AND month = %(month)s", params)
+            cur.execute("DELETE FROM dw.agg_sales_month_territory WHERE year = %(year)s AND month = %(month)s", params)
+            cur.execute("""
+                INSERT INTO dw.agg_sales_month(
+                  year, month, total_revenue, net_sales, gross_margin, units_sold, discount_weighted,
+                  shipping_days_sum, shipping_days_count, on_time_count, line_count, order_count)
+                SELECT
+                  %(year)s, %(month)s,
+                  SUM(fs.total_due_line),
+                  SUM(fs.line_subtotal),
+                  SUM(fs.gross_margin_amount),
+                  SUM(fs.order_qty),
+                  SUM(fs.unit_price_discount * fs.line_subtotal),
+                  COALESCE(SUM(fs.shipping_days), 0),
+                  COUNT(fs.shipping_days),
+                  COUNT(*) FILTER (WHERE fs.on_time_delivery),
+                  COUNT(*),
+                  COUNT(DISTINCT fs.sales_order_number)
+                FROM dw.fact_sales fs
+                WHERE fs.order_date_key >= %(start)s AND fs.order_date_key < %(end)s
+                HAVING COUNT(*) > 0
+            """, params)
+            cur.execute("""
+                INSERT INTO dw.agg_sales_month_territory(year, month, territory_key, revenue)
+                SELECT %(year)s, %(month)s, fs.territory_key, SUM(fs.total_due_line)
+                FROM dw.fact_sales fs
+                WHERE fs.order_date_key >= %(start)s AND fs.order_date_key < %(end)s
+                GROUP BY fs.territory_key
+            """, params)
+        set_watermark(dw_conn, "agg_sales_month", months[-1], commit=False)
+    if commit:
+        dw_conn.commit()
+
+def rebuild_sales_aggregates(dw_conn) -> None:
+    """Recalcula todos os meses presentes em fact_sales (p.ex. após a migração para os agregados)."""
+    with dw_conn.cursor() as cur:
+        cur.execute("TRUNCATE dw.agg_sales_month, dw.agg_sales_month_territory")
+        cur.execute("SELECT DISTINCT order_date_key / 100 AS yyyymm FROM dw.fact_sales")
+        months = [r["yyyymm"] for r in cur.fetchall()]
+    refresh_sales_aggregates(dw_conn, months)
+
+def seed_sales_aggregates(dw_conn) -> bool:
+    """
+    Reconstrói os agregados se estiverem vazios e fact_sales não (instalação existente migrada para as
+    views sobre os agregados): as cargas incrementais só recalculam os meses que tocam. Retorna se reconstruiu.
+    """
+    with dw_conn.cursor() as cur:
+        cur.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM dw.agg_sales_month)
+                   AND EXISTS (SELECT 1 FROM dw.fact_sales) AS missing
+        """)
+        missing = cur.fetchone()["missing"]
+    if missing:
+        rebuild_sales_aggregates(dw_conn)
+    return missing
@@ -0,0 +1,123 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from .db import dw_conn, fetch_one, fetch_all, execute
+from .metrics import stage, in_context
+
+# Modo de carga em massa (full_load): índices secundários e FKs das tabelas de fatos saem antes da
+# carga e voltam depois, para o COPY só acrescentar linhas ao heap.
+# - prepare: guarda a definição dos índices não únicos e das FKs em dw.etl_bulk_load_ddl e os remove
+#   (uma transação). Índices únicos e PKs ficam: o upsert de fact_purchases e o snapshot dependem deles.
+# - restore: recria os índices em paralelo (um por conexão), recoloca as FKs (NOT VALID + VALIDATE;
+#   em tabela particionada, ADD CONSTRAINT já validando) e roda ANALYZE. Cada objeto recriado sai de
+#   dw.etl_bulk_load_ddl na mesma transação: uma restauração interrompida é retomada com
+#   python -m etl.bulk_load --restore.
+# - No full_load (etl.main), prepare e restore são os nós bulk_prepare/bulk_restore do grafo, em volta
+#   dos fatos; uma falha do grafo também restaura.
+# - ETL_BULK_LOAD=1 liga o modo no full_load; ETL_BULK_WORKERS conexões na reconstrução;
+#   ETL_BULK_MAINTENANCE_WORK_MEM para cada CREATE INDEX.
+
+ENABLED = os.getenv("ETL_BULK_LOAD", "0") == "1"
+WORKERS = int(os.getenv("ETL_BULK_WORKERS", "4"))
+MAINTENANCE_WORK_MEM = os.getenv("ETL_BULK_MAINTENANCE_WORK_MEM", "1GB")
+
+FACT_TABLES = ("dw.fact_sales", "dw.fact_purchases", "dw.fact_inventory_snapshot")
+
+def enabled(bulk=None):
+    return ENABLED if bulk is None else bulk
+
+def prepare(tables=FACT_TABLES):
+    """Guarda e remove os índices secundários e as FKs de tables. Retorna quantos objetos foram removidos."""
+    removed = 0
+    with dw_conn() as dw:
+        for table in tables:
+            indexes = fetch_all(dw, """
+                SELECT i.indexrelid::regclass::text AS name, pg_get_indexdef(i.indexrelid) AS definition
+                  FROM pg_index i
+                 WHERE i.indrelid = %s::regclass AND NOT i.indisunique AND NOT i.indisprimary
+            """, (table,))
+            fks = fetch_all(dw, """
+                SELECT conname AS name, pg_get_constraintdef(oid) AS definition
+                  FROM pg_constraint
+                 WHERE conrelid = %s::regclass AND contype = 'f'
+            """, (table,))
+            for kind, objs in (("index", indexes), ("fk", fks)):
+                for o in objs:
+                    # índice de tabela particionada: "ON ONLY" criaria só o índice do pai, sem as partições
+                    definition = o["definition"].replace(" ON ONLY ", " ON ", 1)
+                    execute(dw, """
+                        INSERT INTO dw.etl_bulk_load_ddl(table_name, kind, name, definition)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (table_name, name) DO NOTHING
+                    """, (table, kind, o["name"], definition), commit=False)
+            for o in fks:
+                execute(dw, f'ALTER TABLE {table} DROP CONSTRAINT "{o["name"]}"', commit=False)
+            for o in indexes:
+                execute(dw, f"DROP INDEX {o['name']}", commit=False)
+            removed += len(indexes) + len(fks)
+        dw.commit()
+    return removed
+
+def _create_index(row):
+    with dw_conn() as dw:
+        execute(dw, "SET LOCAL maintenance_work_mem = %s", (MAINTENANCE_WORK_MEM,), commit=False)
+        execute(dw, row["definition"], commit=False)
+        _forget(dw, row)
+        dw.commit()
+
+def _restore_fks(table, rows):
+    """FKs de uma tabela, em sequência (ADD/VALIDATE CONSTRAINT de uma tabela se bloqueiam entre si)."""
+    with dw_conn() as dw:
+        partitioned = fetch_one(dw, "SELECT relkind = 'p' AS p FROM pg_class WHERE oid = %s::regclass", (table,))["p"]
+        for row in rows:
+            name = row["name"]
+            exists = fetch_one(dw, "SELECT 1 AS x FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+                               (table, name))
+            if not exists:
+                # tabela particionada não aceita FK NOT VALID: valida ao criar
+                execute(dw, f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {row["definition"]}'
+                            + ("" if partitioned else " NOT VALID"))
+            if not partitioned:
+                execute(dw, f'ALTER TABLE {table} VALIDATE CONSTRAINT "{name}"', commit=False)
+            _forget(dw, row)
+            dw.commit()
+
+def _analyze(table):
+    with dw_conn() as dw:
+        execute(dw, f"ANALYZE {table}")
+
+def _forget(dw, row):
+    execute(dw, "DELETE FROM dw.etl_bulk_load_ddl WHERE table_name = %s AND name = %s",
+            (row["table_name"], row["name"]), commit=False)
+
+def _parallel(calls, workers):
+    """Executa calls [(fn, args)] em até workers threads; levanta a primeira falha após todas terminarem."""
+    if not calls:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(calls))) as pool:
+        futures = [pool.submit(in_context(fn), *args) for fn, args in calls]
+    for f in futures:
+        f.result()
+
+def restore(workers=None):
+    """Recria o DDL guardado por prepare (índices em paralelo, depois FKs) e analisa as tabelas."""
+    workers = workers or WORKERS
+    with dw_conn() as dw:
+        ddl = fetch_all(dw, "SELECT table_name, kind, name, definition FROM dw.etl_bulk_load_ddl ORDER BY table_name, name")
+    if not ddl:
+        return
+    tables = sorted({r["table_name"] for r in ddl})
+    with stage("indexes"):
+        _parallel([(_create_index, (r,)) for r in ddl if r["kind"] == "index"], workers)
+    with stage("constraints"):
+        fks = [r for r in ddl if r["kind"] == "fk"]
+        _parallel([(_restore_fks, (table, list(rows))) for table, rows in groupby(fks, key=lambda r: r["table_name"])],
+                  workers)
+    with stage("analyze"):
+        _parallel([(_analyze, (table,)) for table in tables], workers)
+
+if __name__ == "__main__":
+    # python -m etl.bulk_load --restore   (conclui uma restauração interrompida)
+    if "--restore" in sys.argv[1:]:
+        restore()
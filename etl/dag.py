@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple, Tuple
+from .db import oltp_conn, dw_conn, fetch_all, get_watermark, set_watermark
+from .metrics import stage, in_context
+
+log = logging.getLogger(__name__)
+
+# Agendador das execuções do ETL como grafo de dependências (main.py declara os grafos).
+# - Cada nó é um loader com as suas dependências (deps) e as tabelas do OLTP que lê (sources).
+#   Nós prontos (dependências concluídas) rodam em paralelo, em até ETL_DAG_WORKERS threads;
+#   a duração total tende à do caminho crítico, e não à soma dos nós.
+# - Assinatura de um nó: md5 de count(*)/max(modifieddate) de cada source (uma consulta ao OLTP para
+#   o grafo inteiro, lida antes de qualquer nó rodar) e das assinaturas das dependências. Com
+#   skip_unchanged, um nó cuja assinatura é a mesma do último sucesso é pulado.
+# - Estado em dw.etl_run_control: 'dag.<grafo>.<nó>' = {signature, run} a cada nó concluído e
+#   'dag.<grafo>' = {run, status, failed}. Uma falha não interrompe ramos independentes; os
+#   dependentes do nó que falhou ficam bloqueados. Com resume, uma execução após uma falha retoma a
+#   anterior: os nós já concluídos nela são pulados e rodam só os que falharam ou não chegaram a rodar.
+# - always=True: o nó roda sempre (não é pulado por assinatura nem na retomada).
+
+WORKERS = int(os.getenv("ETL_DAG_WORKERS", "4"))
+
+class Node(NamedTuple):
+    name: str
+    fn: Callable[[], object]
+    deps: Tuple[str, ...] = ()
+    sources: Tuple[str, ...] = ()  # tabelas do OLTP (schema.tabela) com modifieddate
+    always: bool = False
+
+class DagFailed(Exception):
+    """Um ou mais nós falharam; errors = [(nó, exceção)], status = {nó: situação final}."""
+    def __init__(self, graph, errors, status):
+        self.graph = graph
+        self.errors = errors
+        self.status = status
+        blocked = sorted(n for n, s in status.items() if s == "blocked")
+        super().__init__("; ".join(f"{name}: {exc!r}" for name, exc in errors)
+                         + (f" (bloqueados: {', '.join(blocked)})" if blocked else ""))
+
+def topological_order(nodes):
+    """Nomes dos nós em ordem de dependência; ValueError para dependência desconhecida ou ciclo."""
+    by_name = {n.name: n for n in nodes}
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"ciclo no grafo: {' -> '.join(path + (name,))}")
+        if name not in by_name:
+            raise ValueError(f"dependência desconhecida: {name} (de {path[-1]})")
+        state[name] = "visiting"
+        for dep in by_name[name].deps:
+            visit(dep, path + (name,))
+        state[name] = "done"
+        order.append(name)
+
+    for n in nodes:
+        visit(n.name, ())
+    return order
+
+def source_versions(tables):
+    """{tabela: [linhas, max(modifieddate)]} das tabelas do OLTP, em uma consulta."""
+    if not tables:
+        return {}
+    sql = " UNION ALL ".join(
+        f"SELECT '{t}' AS source, count(*) AS n, max(modifieddate)::text AS m FROM {t}" for t in sorted(tables))
+    with oltp_conn() as oltp:
+        return {r["source"]: [r["n"], r["m"]] for r in fetch_all(oltp, sql)}
+
+def signatures(nodes, order, versions):
+    by_name = {n.name: n for n in nodes}
+    sig = {}
+    for name in order:
+        node = by_name[name]
+        payload = {"sources": {t: versions[t] for t in node.sources}, "deps": {d: sig[d] for d in node.deps}}
+        sig[name] = hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return sig
+
+def _state_key(graph, node=None):
+    return f"dag.{graph}" if node is None else f"dag.{graph}.{node}"
+
+def _load_state(dw, key):
+    value = get_watermark(dw, key)
+    return json.loads(value) if value else {}
+
+def _save_state(key, value):
+    with dw_conn() as dw:
+        set_watermark(dw, key, json.dumps(value))
+
+def _run_node(node):
+    with stage(node.name):
+        node.fn()
+
+def run_graph(graph, nodes, skip_unchanged=True, resume=True, max_workers=None):
+    """
+    Executa o grafo graph (lista de Node). Retorna {nó: 'success' | 'unchanged' | 'resumed'};
+    se algum nó falhar, levanta DagFailed depois que todos os ramos independentes terminarem.
+    """
+    order = topological_order(nodes)
+    by_name = {n.name: n for n in nodes}
+    sig = signatures(nodes, order, source_versions({t for n in nodes for t in n.sources}))
+    with dw_conn() as dw:
+        previous = _load_state(dw, _state_key(graph))
+        node_state = {name: _load_state(dw, _state_key(graph, name)) for name in order}
+
+    resuming = resume and previous.get("status") in ("failed", "running")
+    run_id = previous["run"] if resuming else datetime.now(timezone.utc).isoformat()
+    status = {}
+    for name in order:
+        node, saved = by_name[name], node_state[name]
+        if node.always:
+            continue
+        if resuming and saved.get("run") == run_id:
+            status[name] = "resumed"
+        elif skip_unchanged and saved.get("signature") == sig[name]:
+            status[name] = "unchanged"
+    if resuming:
+        log.info("%s: retomando a execução %s (%d nós já concluídos)", graph, run_id,
+                 sum(s == "resumed" for s in status.values()))
+    _save_state(_state_key(graph), {"run": run_id, "status": "running", "failed": []})
+
+    errors, running = [], {}
+    ok = ("success", "unchanged", "resumed")
+    with ThreadPoolExecutor(max_workers=max_workers or WORKERS) as pool:
+        while True:
+            for name in order:
+                if name in status or name in running:
+                    continue
+                deps = [status.get(d) for d in by_name[name].deps]
+                if any(s in ("failed", "blocked") for s in deps):
+                    status[name] = "blocked"
+                elif all(s in ok for s in deps):
+                    running[name] = pool.submit(in_context(_run_node), by_name[name])
+            if not running:
+                break
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name in [n for n, f in running.items() if f in done]:
+                exc = running.pop(name).exception()
+                if exc is None:
+                    status[name] = "success"
+                    _save_state(_state_key(graph, name), {"signature": sig[name], "run": run_id})
+                    log.info("%s: %s concluído", graph, name)
+                else:
+                    status[name] = "failed"
+                    errors.append((name, exc))
+                    log.error("%s: %s falhou: %r", graph, name, exc)
+
+    for name in order:
+        if status.get(name) in ("unchanged", "resumed"):
+            log.info("%s: %s pulado (%s)", graph, name, "entradas inalteradas" if status[name] == "unchanged"
+                     else "concluído na execução retomada")
+    failed = [name for name, _ in errors]
+    _save_state(_state_key(graph), {"run": run_id, "status": "failed" if errors else "success", "failed": failed})
+    if errors:
+        raise DagFailed(graph, errors, status)
+    return status
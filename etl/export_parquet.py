@@ -0,0 +1,158 @@
+import os
+import re
+import shutil
+import sys
+from .db import dw_conn, fetch_all, stream_batches, get_watermark, set_watermark
+from .metrics import stage, count_rows
+from .partitions import month_bounds
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # exportação opcional: pip install pyarrow
+    pa = pq = None
+
+# Exportação do modelo estrela para Parquet (leitura local pelos dashboards, sem consultar o DW).
+# Layout em ETL_EXPORT_DIR (particionamento estilo Hive, lido direto por Power BI/pyarrow/DuckDB):
+#   <tabela>/part-0.parquet                                 dimensões e agregados (reescritos a cada execução)
+#   <fato>/year=YYYY/month=MM/part-0.parquet                fatos, um arquivo por mês
+# Fatos incrementais: só os meses com linhas gravadas desde a última exportação são reescritos.
+# A coluna de alteração de cada fato (created_at; updated_at em fact_purchases, que recebe upserts)
+# é comparada com o watermark 'export_<fato>' em dw.etl_run_control.
+# Cada arquivo é gravado em um .tmp e renomeado: quem lê nunca vê um arquivo pela metade.
+# Sem ETL_EXPORT_DIR a exportação fica desligada.
+
+EXPORT_DIR = os.getenv("ETL_EXPORT_DIR", "")
+# Linhas por leitura do DW e por row group no Parquet
+EXPORT_BATCH_ROWS = int(os.getenv("ETL_EXPORT_BATCH_ROWS", "100000"))
+COMPRESSION = os.getenv("ETL_EXPORT_COMPRESSION", "zstd")
+
+TABLE_EXPORTS = (
+    "dim_date", "dim_product", "dim_customer", "dim_territory", "dim_employee", "dim_store",
+    "dim_shipmethod", "dim_promotion", "dim_vendor", "dim_creditcard", "dim_location",
+    "agg_sales_month", "agg_sales_month_territory",
+)
+
+# fato -> (coluna yyyymmdd que define o mês, coluna de alteração)
+FACT_EXPORTS = {
+    "fact_sales": ("order_date_key", "created_at"),
+    "fact_purchases": ("order_date_key", "updated_at"),
+    "fact_inventory_snapshot": ("snapshot_date_key", "created_at"),
+}
+
+def arrow_type(pg_type):
+    """Tipo Arrow de uma coluna (format_type do PostgreSQL)."""
+    m = re.fullmatch(r"numeric\((\d+),(\d+)\)", pg_type)
+    if m:
+        return pa.decimal128(int(m[1]), int(m[2]))
+    return {
+        "smallint": pa.int16(),
+        "integer": pa.int32(),
+        "bigint": pa.int64(),
+        "numeric": pa.float64(),  # sem precisão declarada (agregados): lido como float8
+        "boolean": pa.bool_(),
+        "date": pa.date32(),
+        "timestamp without time zone": pa.timestamp("us"),
+        "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+    }.get(pg_type, pa.string())
+
+def table_schema(dw, table):
+    """(schema Arrow, lista do SELECT) de todas as colunas de dw.<table>, na ordem da tabela."""
+    rows = fetch_all(dw, """
+        SELECT attname, format_type(atttypid, atttypmod) AS type
+          FROM pg_attribute
+         WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+         ORDER BY attnum
+    """, (f"dw.{table}",))
+    fields = [pa.field(r["attname"], arrow_type(r["type"])) for r in rows]
+    select = ", ".join(f'"{r["attname"]}"::float8 AS "{r["attname"]}"' if r["type"] == "numeric"
+                       else f'"{r["attname"]}"' for r in rows)
+    return pa.schema(fields), select
+
+def write_parquet(dw, path, schema, sql, params=None):
+    """Grava o resultado de sql em path (via .tmp + rename), um row group por lote. Retorna as linhas."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    n = 0
+    with pq.ParquetWriter(tmp, schema, compression=COMPRESSION) as writer:
+        for batch in stream_batches(dw, sql, params, batch_size=EXPORT_BATCH_ROWS):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            n += len(batch)
+    os.replace(tmp, path)
+    count_rows(rows_out=n)
+    return n
+
+def month_path(root, yyyymm):
+    return os.path.join(root, f"year={yyyymm // 100}", f"month={yyyymm % 100:02d}", "part-0.parquet")
+
+def export_table(dw, directory, table):
+    """Reescreve o arquivo único de uma dimensão/agregado. Retorna as linhas."""
+    schema, select = table_schema(dw, table)
+    return write_parquet(dw, os.path.join(directory, table, "part-0.parquet"), schema,
+                         f"SELECT {select} FROM dw.{table}")
+
+def changed_months(dw, table, date_col, changed_col, since=None):
+    """{yyyymm: maior valor da coluna de alteração} dos meses com linhas alteradas após since (None: todos)."""
+    rows = fetch_all(dw, f"""
+        SELECT {date_col} / 100 AS yyyymm, max({changed_col}) AS changed_at
+          FROM dw.{table}
+         WHERE (%(since)s IS NULL OR {changed_col} > %(since)s)
+         GROUP BY 1
+    """, {"since": since})
+    return {r["yyyymm"]: r["changed_at"] for r in rows}
+
+def export_fact(dw, directory, table, full=False):
+    """
+    Reescreve os meses do fato alterados desde a última exportação (full: todos, em um diretório novo
+    que substitui o anterior, descartando meses que deixaram de existir). Retorna os meses reescritos.
+    """
+    date_col, changed_col = FACT_EXPORTS[table]
+    pipeline = f"export_{table}"
+    months = changed_months(dw, table, date_col, changed_col, None if full else get_watermark(dw, pipeline))
+    if not months:
+        return []
+    schema, select = table_schema(dw, table)
+    final = os.path.join(directory, table)
+    root = final + ".new" if full else final
+    if full:
+        shutil.rmtree(root, ignore_errors=True)
+    for yyyymm in sorted(months):
+        start, end = month_bounds(yyyymm)
+        # filtro por faixa de date key: em fact_sales, partition pruning no mês
+        write_parquet(dw, month_path(root, yyyymm), schema, f"""
+            SELECT {select} FROM dw.{table}
+             WHERE {date_col} >= %(start)s AND {date_col} < %(end)s
+        """, {"start": start, "end": end})
+    if full:
+        old = final + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(final):
+            os.rename(final, old)
+        os.rename(root, final)
+        shutil.rmtree(old, ignore_errors=True)
+    set_watermark(dw, pipeline, max(months.values()).isoformat())
+    return sorted(months)
+
+def export_star_schema(directory=None, full=False):
+    """
+    Exporta dimensões, agregados e fatos para directory (default ETL_EXPORT_DIR); sem diretório não faz nada.
+    full=True reescreve todos os meses dos fatos (após uma carga full). Retorna {fato: meses reescritos}.
+    """
+    directory = directory or EXPORT_DIR
+    if not directory:
+        return None
+    if pa is None:
+        raise RuntimeError("exportação Parquet requer pyarrow (pip install pyarrow)")
+    with dw_conn() as dw:
+        for table in TABLE_EXPORTS:
+            with stage(table):
+                export_table(dw, directory, table)
+        written = {}
+        for table in FACT_EXPORTS:
+            with stage(table):
+                written[table] = export_fact(dw, directory, table, full)
+    return written
+
+if __name__ == "__main__":
+    # python -m etl.export_parquet [--full]
+    export_star_schema(full="--full" in sys.argv[1:])
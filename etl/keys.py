@@ -0,0 +1,179 @@
+from bisect import bisect_right
+from datetime import date, datetime
+from typing import Dict, Any, Iterable, List, Optional
+from .db import fetch_all
+from .metrics import stage
+
+# Resolver de chaves substitutas compartilhado pelas cargas de fatos.
+# Estratégia:
+# - No início da carga, pré-carrega NK -> SK de todas as dimensões (SCD2 apenas linhas correntes).
+# - Lookups são feitos em memória; NKs ausentes são buscados no DW em lote (WHERE nk = ANY(...)).
+# - Mantém contadores de hit/miss por dimensão.
+# - Com as_of=True, as dimensões SCD2 são carregadas com todas as versões (AsOfIndex) e
+#   get_as_of resolve a versão vigente na data do fato (p.ex. orderdate) em vez da corrente.
+
+# dimensão -> (tabela, coluna NK, coluna SK, filtro adicional)
+DIMENSIONS = {
+    "product":     ("dw.dim_product",     "product_nk",     "product_key",     "is_current"),
+    "customer":    ("dw.dim_customer",    "customer_nk",    "customer_key",    "is_current"),
+    "territory":   ("dw.dim_territory",   "territory_nk",   "territory_key",   None),
+    "employee":    ("dw.dim_employee",    "employee_nk",    "employee_key",    None),
+    "store":       ("dw.dim_store",       "store_nk",       "store_key",       None),
+    "shipmethod":  ("dw.dim_shipmethod",  "ship_method_nk", "ship_method_key", None),
+    "promotion":   ("dw.dim_promotion",   "promotion_nk",   "promotion_key",   None),
+    "vendor":      ("dw.dim_vendor",      "vendor_nk",      "vendor_key",      None),
+    "creditcard":  ("dw.dim_creditcard",  "credit_card_nk", "credit_card_key", None),
+    "location":    ("dw.dim_location",    "location_nk",    "location_key",    None),
+}
+
+SCD2_DIMENSIONS = ("product", "customer")
+
+def lookup_sql(columns: Dict[str, str], source: str = "s", as_of: str = None):
+    """
+    Equivalente SQL do KeyResolver (cargas executadas no banco): columns = dimensão -> coluna de source
+    com o NK. Retorna ({dimensão: expressão da SK}, LEFT JOINs); NK ausente ou nulo -> SK nula.
+    as_of: expressão date de source; as dimensões SCD2 resolvem a versão vigente nela, como o AsOfIndex
+    (data nula: versão corrente).
+    """
+    exprs, joins = {}, []
+    for dim, col in columns.items():
+        table, nk_col, key_col, flt = DIMENSIONS[dim]
+        alias = f"k_{dim}"
+        if as_of and dim in SCD2_DIMENSIONS:
+            when = f"COALESCE({as_of}, 'infinity'::date)"
+            joins.append(f"""LEFT JOIN LATERAL (
+                SELECT * FROM {table} v
+                 WHERE v.{nk_col} = {source}.{col}
+                 ORDER BY v.valid_from <= {when} DESC,
+                          CASE WHEN v.valid_from <= {when} THEN v.valid_from END DESC,
+                          v.valid_from, v.{key_col} DESC
+                 LIMIT 1) {alias} ON true""")
+        else:
+            cond = f"{alias}.{nk_col} = {source}.{col}"
+            if flt:
+                cond += f" AND {alias}.{flt}"
+            joins.append(f"LEFT JOIN {table} {alias} ON {cond}")
+        exprs[dim] = f"{alias}.{key_col}"
+    return exprs, "\n".join(joins)
+
+class AsOfIndex:
+    """
+    Versões SCD2 por NK: valid_from em ordem crescente (busca binária) e as SKs correspondentes.
+    get(nk, dia) devolve a versão com o maior valid_from <= dia em O(log n). Dias anteriores à
+    primeira versão (fatos mais antigos que a carga da dimensão) ficam com a primeira versão;
+    várias versões no mesmo dia: vale a última.
+    """
+    def __init__(self):
+        self._from: Dict[Any, List[date]] = {}
+        self._keys: Dict[Any, List[int]] = {}
+
+    def add(self, nk, valid_from: date, key: int) -> None:
+        """Inclui uma versão; as versões de cada NK devem chegar em ordem de (valid_from, key)."""
+        froms = self._from.setdefault(nk, [])
+        keys = self._keys.setdefault(nk, [])
+        if froms and froms[-1] == valid_from:
+            keys[-1] = key
+        else:
+            froms.append(valid_from)
+            keys.append(key)
+
+    def __contains__(self, nk) -> bool:
+        return nk in self._from
+
+    def get(self, nk, day: date) -> Optional[int]:
+        froms = self._from.get(nk)
+        if not froms:
+            return None
+        return self._keys[nk][max(bisect_right(froms, day) - 1, 0)]
+
+class KeyResolver:
+    def __init__(self, dw_conn, as_of: bool = False):
+        self.dw = dw_conn
+        self.keys: Dict[str, Dict[Any, int]] = {dim: {} for dim in DIMENSIONS}
+        self.standard_cost: Dict[int, Any] = {}
+        self.hits: Dict[str, int] = {dim: 0 for dim in DIMENSIONS}
+        self.misses: Dict[str, int] = {dim: 0 for dim in DIMENSIONS}
+        # NKs já buscados no DW e não encontrados (evita nova consulta)
+        self._absent: Dict[str, set] = {dim: set() for dim in DIMENSIONS}
+        # dimensão SCD2 -> todas as versões (somente com as_of)
+        self.history: Dict[str, AsOfIndex] = {dim: AsOfIndex() for dim in SCD2_DIMENSIONS} if as_of else {}
+
+    def _select(self, dim: str, nks: Optional[list] = None):
+        table, nk_col, key_col, flt = DIMENSIONS[dim]
+        cols = f"{nk_col} AS nk, {key_col} AS id"
+        if dim == "product":
+            cols += ", standard_cost"
+        index = self.history.get(dim)
+        where = [flt] if flt and index is None else []
+        params = ()
+        if nks is not None:
+            where.append(f"{nk_col} = ANY(%s)")
+            params = (nks,)
+        sql = f"SELECT {cols} FROM {table}"
+        if index is not None:
+            sql = f"SELECT {cols}, valid_from, is_current FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if index is not None:
+            sql += f" ORDER BY {nk_col}, valid_from, {key_col}"
+        for r in fetch_all(self.dw, sql, params):
+            if index is not None:
+                index.add(r["nk"], r["valid_from"], r["id"])
+            if index is None or r["is_current"]:
+                self.keys[dim][r["nk"]] = r["id"]
+            if dim == "product":
+                self.standard_cost[r["id"]] = r["standard_cost"]
+
+    def preload(self, dims: Optional[Iterable[str]] = None) -> "KeyResolver":
+        with stage("keys"):
+            for dim in dims or DIMENSIONS:
+                self._select(dim)
+        return self
+
+    def prefetch(self, dim: str, nks: Iterable[Any]) -> None:
+        """Busca em uma única consulta os NKs ainda não resolvidos de uma dimensão."""
+        known = self.keys[dim]
+        absent = self._absent[dim]
+        missing = {nk for nk in nks if nk is not None and nk not in known and nk not in absent}
+        if not missing:
+            return
+        self._select(dim, list(missing))
+        absent.update(missing - known.keys())
+
+    def prefetch_rows(self, rows: Iterable[Dict[str, Any]], columns: Dict[str, str]) -> None:
+        """columns: dimensão -> coluna da linha de origem com o NK (ex.: {"product": "productid"})."""
+        rows = list(rows)
+        for dim, col in columns.items():
+            self.prefetch(dim, (r[col] for r in rows))
+
+    def get(self, dim: str, nk: Any) -> Optional[int]:
+        if nk is None:
+            return None
+        key = self.keys[dim].get(nk)
+        if key is not None:
+            self.hits[dim] += 1
+            return key
+        self.misses[dim] += 1
+        if nk not in self._absent[dim]:
+            self.prefetch(dim, [nk])
+            key = self.keys[dim].get(nk)
+        return key
+
+    def get_as_of(self, dim: str, nk: Any, when) -> Optional[int]:
+        """SK da versão vigente em when (date/datetime); sem as_of, dimensão SCD1 ou when nulo: get()."""
+        index = self.history.get(dim)
+        if index is None or nk is None or when is None:
+            return self.get(dim, nk)
+        if nk in index:
+            self.hits[dim] += 1
+        else:
+            self.misses[dim] += 1
+            if nk not in self._absent[dim]:
+                self.prefetch(dim, [nk])
+        return index.get(nk, when.date() if isinstance(when, datetime) else when)
+
+    def get_standard_cost(self, product_key: Optional[int]):
+        return self.standard_cost.get(product_key) if product_key is not None else None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {dim: {"hits": self.hits[dim], "misses": self.misses[dim]} for dim in DIMENSIONS}
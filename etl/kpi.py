@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlparse, parse_qs
+from .db import dw_conn, fetch_one, fetch_all
+
+# Camada de acesso aos KPIs (views de sql/03_views_kpis.sql) com cache LRU em memória.
+# - Cada resultado fica em cache por (kpi, ano, mês, território).
+# - A versão dos dados é max(updated_at) dos watermarks de VERSION_PIPELINES em dw.etl_run_control: as
+#   cargas das tabelas lidas pelas views gravam o watermark na mesma transação das linhas/agregados.
+#   Os demais registros (estado do DAG, exportação Parquet, faixas da carga full) não invalidam o cache.
+#   Enquanto a versão não muda, as leituras saem do cache; quando muda, o cache inteiro é descartado.
+# - A versão é lida antes dos dados: um resultado nunca é guardado sob uma versão mais nova que ele.
+# - ETL_KPI_VERSION_TTL > 0 reaproveita a versão por esse número de segundos (menos idas ao banco,
+#   ao custo de até TTL segundos de atraso após uma carga). Default 0: sempre confere.
+#
+#   python -m etl.kpi --port 8050     # GET /kpi, GET /kpi/<nome>?year=2013&month=7&territory=Northwest
+
+CACHE_SIZE = int(os.getenv("ETL_KPI_CACHE_SIZE", "256"))
+VERSION_TTL = float(os.getenv("ETL_KPI_VERSION_TTL", "0"))
+
+# watermarks das tabelas lidas pelas views de KPI: fact_sales, fact_purchases, dim_territory (receita por
+# território) e os agregados (agg_sales_month, gravado por todo recálculo de agg_sales_month*)
+VERSION_PIPELINES = ("fact_sales", "fact_purchases", "dim_territory")
+VERSION_PIPELINE_PATTERN = "agg\\_%"
+
+class Kpi(NamedTuple):
+    view: str
+    territory: bool = False  # aceita filtro por território
+
+KPIS = {
+    "sales_revenue": Kpi("dw.v_kpi_sales_revenue"),
+    "units_sold": Kpi("dw.v_kpi_units_sold"),
+    "aov": Kpi("dw.v_kpi_aov"),
+    "avg_discount": Kpi("dw.v_kpi_avg_discount"),
+    "shipping_days": Kpi("dw.v_kpi_shipping_days"),
+    "on_time_delivery": Kpi("dw.v_kpi_on_time_delivery"),
+    "revenue_by_territory": Kpi("dw.v_kpi_revenue_by_territory", territory=True),
+    "total_purchases": Kpi("dw.v_kpi_total_purchases"),
+}
+
+class UnknownKpi(KeyError):
+    pass
+
+class KpiService:
+    """Consulta de KPIs com cache LRU invalidado pela versão de dw.etl_run_control. Thread-safe."""
+    def __init__(self, max_entries: int = None, version_ttl: float = None):
+        self.max_entries = max_entries or CACHE_SIZE
+        self.version_ttl = VERSION_TTL if version_ttl is None else version_ttl
+        self._cache: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _current_version(self, dw):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.version_ttl:
+            return self._version
+        version = fetch_one(dw, """
+            SELECT max(updated_at) AS v FROM dw.etl_run_control
+             WHERE pipeline_name = ANY(%s) OR pipeline_name LIKE %s
+        """, (list(VERSION_PIPELINES), VERSION_PIPELINE_PATTERN))["v"]
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self._cache.clear()
+                self._version = version
+            self._checked_at = now
+        return version
+
+    def get(self, name: str, year: int = None, month: int = None, territory: str = None) -> List[Dict[str, Any]]:
+        """Linhas da view do KPI, filtradas por ano, mês e (receita por território) território."""
+        kpi = KPIS.get(name)
+        if kpi is None:
+            raise UnknownKpi(name)
+        if territory is not None and not kpi.territory:
+            raise ValueError(f"{name} não tem recorte por território")
+        key = (name, year, month, territory)
+        with dw_conn() as dw:
+            version = self._current_version(dw)
+            with self._lock:
+                rows = self._cache.get(key)
+                if rows is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return rows
+                self.misses += 1
+            where = ["(%(year)s::int IS NULL OR year = %(year)s)", "(%(month)s::int IS NULL OR month = %(month)s)"]
+            if kpi.territory:
+                where.append("(%(territory)s::text IS NULL OR territory = %(territory)s)")
+            rows = fetch_all(dw, f"""
+                SELECT * FROM {kpi.view}
+                 WHERE {" AND ".join(where)}
+                 ORDER BY year, month
+            """, {"year": year, "month": month, "territory": territory})
+        rows = [dict(r) for r in rows]
+        with self._lock:
+            if version == self._version:  # uma carga pode ter mudado a versão durante a consulta
+                self._cache[key] = rows
+                if len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return rows
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._version = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "version": self._version}
+
+_default = None
+_default_lock = threading.Lock()
+
+def service() -> KpiService:
+    """Instância compartilhada do processo."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = KpiService()
+        return _default
+
+def get_kpi(name: str, year: int = None, month: int = None, territory: str = None) -> List[Dict[str, Any]]:
+    return service().get(name, year, month, territory)
+
+def _json_default(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    raise TypeError(repr(v))
+
+def _int_param(params, name) -> Optional[int]:
+    values = params.get(name)
+    return int(values[0]) if values else None
+
+class KpiHandler(BaseHTTPRequestHandler):
+    """GET /kpi (lista e estatísticas do cache) e GET /kpi/<nome>?year=&month=&territory= (JSON)."""
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["kpi"]:
+            return self._send(200, {"kpis": sorted(KPIS), "cache": service().stats()})
+        if len(parts) != 2 or parts[0] != "kpi":
+            return self._send(404, {"error": "use /kpi ou /kpi/<nome>"})
+        params = parse_qs(url.query)
+        try:
+            rows = get_kpi(parts[1], _int_param(params, "year"), _int_param(params, "month"),
+                           params.get("territory", [None])[0])
+        except UnknownKpi:
+            return self._send(404, {"error": f"KPI desconhecido: {parts[1]}"})
+        except ValueError as exc:
+            return self._send(400, {"error": str(exc)})
+        self._send(200, {"kpi": parts[1], "rows": rows})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(host: str = "127.0.0.1", port: int = 8050) -> None:
+    server = ThreadingHTTPServer((host, port), KpiHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Endpoint HTTP local dos KPIs do DW")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8050)
+    args = ap.parse_args()
+    serve(args.host, args.port)
@@ -1,25 +1,65 @@
-from datetime import date, timedelta
-from .db import get_conn_dw, execute
-
-def daterange(d1, d2):
-    for n in range((d2 - d1).days + 1):
-        yield d1 + timedelta(days=n)
+from datetime import date, datetime, timedelta
+from .db import oltp_conn, dw_conn, execute, fetch_one
 
 def yyyymmdd(d: date) -> int:
     return d.year * 10000 + d.month * 100 + d.day
 
+def _as_date(v):
+    return v.date() if isinstance(v, datetime) else v
+
 def load_dim_date(start=date(2000,1,1), end=date(2015,12,31)):
-    dw = get_conn_dw()
-    try:
-        for d in daterange(start, end):
-            execute(dw, """
-                INSERT INTO dw.dim_date(date_key, full_date, year, quarter, month, day, week, day_of_week, is_weekend)
-                VALUES (%s, %s, %s, EXTRACT(QUARTER FROM %s)::int, %s, %s, EXTRACT(WEEK FROM %s)::int,
-                        EXTRACT(ISODOW FROM %s)::int, CASE WHEN EXTRACT(ISODOW FROM %s) IN (6,7) THEN true ELSE false END)
-                ON CONFLICT (date_key) DO NOTHING
-            """, (yyyymmdd(d), d, d.year, d, d.month, d.day, d, d, d))
-    finally:
-        dw.close()
+    # Calendário inteiro em um único INSERT ... SELECT (atributos calculados no servidor, em lote)
+    with dw_conn() as dw:
+        execute(dw, """
+            INSERT INTO dw.dim_date(date_key, full_date, year, quarter, month, day, week, day_of_week, is_weekend)
+            SELECT
+              to_char(g.d, 'YYYYMMDD')::int,
+              g.d,
+              EXTRACT(YEAR FROM g.d)::int,
+              EXTRACT(QUARTER FROM g.d)::int,
+              EXTRACT(MONTH FROM g.d)::int,
+              EXTRACT(DAY FROM g.d)::int,
+              EXTRACT(WEEK FROM g.d)::int,
+              EXTRACT(ISODOW FROM g.d)::int,
+              EXTRACT(ISODOW FROM g.d) IN (6, 7)
+            FROM (SELECT gs::date AS d FROM generate_series(%s::date, %s::date, interval '1 day') gs) g
+            ON CONFLICT (date_key) DO NOTHING
+        """, (start, end))
+
+def source_date_range():
+    """Menor e maior data referenciada pelos pedidos de venda e de compra no OLTP."""
+    with oltp_conn() as oltp:
+        r = fetch_one(oltp, """
+          SELECT LEAST(s.min_d, p.min_d) AS min_d, GREATEST(s.max_d, p.max_d) AS max_d
+          FROM (SELECT LEAST(min(orderdate), min(duedate), min(shipdate)) AS min_d,
+                       GREATEST(max(orderdate), max(duedate), max(shipdate)) AS max_d
+                FROM sales.salesorderheader) s,
+               (SELECT LEAST(min(orderdate), min(shipdate)) AS min_d,
+                       GREATEST(max(orderdate), max(shipdate)) AS max_d
+                FROM purchasing.purchaseorderheader) p
+        """)
+    return _as_date(r["min_d"]), _as_date(r["max_d"])
+
+def ensure_dim_date_range(*extra_dates):
+    """
+    Estende dw.dim_date para cobrir todas as datas do OLTP (e extra_dates, p.ex. a data do snapshot).
+    Só insere o que falta antes/depois da faixa atual. Retorna a faixa coberta (início, fim).
+    """
+    wanted = [d for d in (*source_date_range(), *map(_as_date, extra_dates)) if d]
+    if not wanted:
+        return None
+    start, end = min(wanted), max(wanted)
+    with dw_conn() as dw:
+        cur = fetch_one(dw, "SELECT min(full_date) AS lo, max(full_date) AS hi FROM dw.dim_date")
+    lo, hi = cur["lo"], cur["hi"]
+    if lo is None:
+        load_dim_date(start, end)
+        return start, end
+    if start < lo:
+        load_dim_date(start, lo - timedelta(days=1))
+    if end > hi:
+        load_dim_date(hi + timedelta(days=1), end)
+    return min(start, lo), max(end, hi)
 
 if __name__ == "__main__":
-    load_dim_date()
\ No newline at end of file
+    load_dim_date()
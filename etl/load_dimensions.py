@@ -1,11 +1,45 @@
 from datetime import date
-from .db import get_conn_oltp, get_conn_dw, fetch_all, execute
-from .scd import upsert_scd2_product, upsert_scd2_customer
+from itertools import chain
+from .db import oltp_conn, dw_conn, stream_batches, stream_rows, executemany, fetch_all, get_watermark, set_watermark
+from .scd import merge_scd2, scd1_upsert_sql, changed_since, SCD1Spec, PRODUCT_SCD2, CUSTOMER_SCD2
+from .pushdown import enabled as pushdown_enabled, upsert_scd1
 
-def load_dim_product():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, """
+# Extração incremental: cada dimensão guarda em dw.etl_run_control (pipeline = nome da dimensão)
+# o maior modifieddate já carregado e só relê as linhas com modifieddate >= watermark.
+# Em fontes com joins, modifieddate = GREATEST dos modifieddate das tabelas que alimentam a linha.
+# incremental=False relê tudo (o row_hash/merge continua evitando regravar o que não mudou).
+
+class ModifiedWatermark:
+    """Watermark por modifieddate de uma dimensão: since para a extração, max das linhas vistas para gravar."""
+    def __init__(self, dw, pipeline, incremental=True):
+        self.pipeline = pipeline
+        self.since = get_watermark(dw, pipeline) if incremental else None
+        self.max = None
+
+    def params(self):
+        return {"since": self.since}
+
+    def observe(self, rows):
+        for r in rows:
+            m = r["modifieddate"]
+            if m is not None and (self.max is None or m > self.max):
+                self.max = m
+        return rows
+
+    def track(self, rows):
+        for r in rows:
+            self.observe((r,))
+            yield r
+
+    def save(self, dw, max_modified=None):
+        value = max_modified or self.max
+        if value is not None:
+            set_watermark(dw, self.pipeline, value.isoformat())
+
+def load_dim_product(incremental=True):
+    with oltp_conn() as oltp, dw_conn() as dw:
+        wm = ModifiedWatermark(dw, "dim_product", incremental)
+        rows = stream_rows(oltp, changed_since("""
             SELECT
               p.productid AS product_nk,
               p.name AS product_name,
@@ -16,195 +50,144 @@ def load_dim_product():
               sc.name AS subcategory,
               c.name AS category,
               p.standardcost AS standard_cost,
-              p.listprice AS list_price
+              p.listprice AS list_price,
+              GREATEST(p.modifieddate, sc.modifieddate, c.modifieddate) AS modifieddate
             FROM production.product p
             LEFT JOIN production.productsubcategory sc ON sc.productsubcategoryid = p.productsubcategoryid
             LEFT JOIN production.productcategory c ON c.productcategoryid = sc.productcategoryid
             WHERE p.discontinueddate IS NULL OR p.discontinueddate IS NOT NULL
-        """)
-        for r in rows:
-            r["valid_from"] = date.today()
-            upsert_scd2_product(dw, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_customer():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
+        """), wm.params())
+        merge_scd2(dw, PRODUCT_SCD2, wm.track(rows), valid_from=date.today())
+        wm.save(dw)
+
+def load_dim_customer(incremental=True):
+    with oltp_conn() as oltp, dw_conn() as dw:
+        wm = ModifiedWatermark(dw, "dim_customer", incremental)
         # Individual customers
-        rows_individual = fetch_all(oltp, """
+        rows_individual = stream_rows(oltp, changed_since("""
           SELECT
             c.customerid AS customer_nk,
             'Individual'::text AS customer_type,
             c.personid AS person_nk,
             NULL::int AS store_nk,
             COALESCE(pp.firstname || ' ' || pp.lastname, 'N/A') AS customer_name,
-            ea.emailaddress,
+            ea.emailaddress AS email_address,
             ph.phonenumber AS phone,
-            c.territoryid AS territory_nk
+            c.territoryid AS territory_nk,
+            GREATEST(c.modifieddate, pp.modifieddate, ea.modifieddate, ph.modifieddate) AS modifieddate
           FROM sales.customer c
           JOIN person.person pp ON pp.businessentityid = c.personid
           LEFT JOIN person.emailaddress ea ON ea.businessentityid = c.personid
           LEFT JOIN person.personphone ph ON ph.businessentityid = c.personid
           WHERE c.personid IS NOT NULL
-        """)
+        """), wm.params())
         # Store customers
-        rows_store = fetch_all(oltp, """
+        rows_store = stream_rows(oltp, changed_since("""
           SELECT
             c.customerid AS customer_nk,
             'Store'::text AS customer_type,
             NULL::int AS person_nk,
             s.businessentityid AS store_nk,
             s.name AS customer_name,
-            NULL::text AS emailaddress,
+            NULL::text AS email_address,
             NULL::text AS phone,
-            c.territoryid AS territory_nk
+            c.territoryid AS territory_nk,
+            GREATEST(c.modifieddate, s.modifieddate) AS modifieddate
           FROM sales.customer c
           JOIN sales.store s ON s.businessentityid = c.storeid
           WHERE c.storeid IS NOT NULL
-        """)
-
-        dw_conn = dw
-        for r in rows_individual + rows_store:
-            r["email_address"] = r.pop("emailaddress", None)
-            r["valid_from"] = date.today()
-            upsert_scd2_customer(dw_conn, r)
-
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_territory():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, """
-          SELECT territoryid AS territory_nk, name, countryregioncode, "group"
-          FROM sales.salesterritory
-        """)
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_territory(territory_nk, name, country_region_code, "group")
-              VALUES (%(territory_nk)s, %(name)s, %(countryregioncode)s, %(group)s)
-              ON CONFLICT (territory_nk) DO UPDATE
-                SET name = EXCLUDED.name,
-                    country_region_code = EXCLUDED.country_region_code,
-                    "group" = EXCLUDED."group"
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_employee():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, """
-          SELECT sp.businessentityid AS employee_nk, COALESCE(p.firstname || ' ' || p.lastname, 'N/A') AS employee_name
-          FROM sales.salesperson sp
-          JOIN person.person p ON p.businessentityid = sp.businessentityid
-        """)
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_employee(employee_nk, employee_name)
-              VALUES (%(employee_nk)s, %(employee_name)s)
-              ON CONFLICT (employee_nk) DO UPDATE SET employee_name = EXCLUDED.employee_name
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_store():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, """
-          SELECT businessentityid AS store_nk, name AS store_name
-          FROM sales.store
-        """)
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_store(store_nk, store_name)
-              VALUES (%(store_nk)s, %(store_name)s)
-              ON CONFLICT (store_nk) DO UPDATE SET store_name = EXCLUDED.store_name
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_shipmethod():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, "SELECT shipmethodid AS ship_method_nk, name FROM purchasing.shipmethod")
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_shipmethod(ship_method_nk, name)
-              VALUES (%(ship_method_nk)s, %(name)s)
-              ON CONFLICT (ship_method_nk) DO UPDATE SET name = EXCLUDED.name
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_promotion():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, """
-          SELECT specialofferid AS promotion_nk, description, discountpct AS discount_pct, type, category
-          FROM sales.specialoffer
-        """)
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_promotion(promotion_nk, description, discount_pct, "type", category)
-              VALUES (%(promotion_nk)s, %(description)s, %(discount_pct)s, %(type)s, %(category)s)
-              ON CONFLICT (promotion_nk) DO UPDATE
-                SET description = EXCLUDED.description,
-                    discount_pct = EXCLUDED.discount_pct,
-                    "type" = EXCLUDED."type",
-                    category = EXCLUDED.category
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_vendor():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, "SELECT businessentityid AS vendor_nk, name AS vendor_name FROM purchasing.vendor")
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_vendor(vendor_nk, vendor_name)
-              VALUES (%(vendor_nk)s, %(vendor_name)s)
-              ON CONFLICT (vendor_nk) DO UPDATE SET vendor_name = EXCLUDED.vendor_name
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_creditcard():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, "SELECT creditcardid AS credit_card_nk, cardtype AS card_type FROM sales.creditcard")
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_creditcard(credit_card_nk, card_type)
-              VALUES (%(credit_card_nk)s, %(card_type)s)
-              ON CONFLICT (credit_card_nk) DO UPDATE SET card_type = EXCLUDED.card_type
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_dim_location():
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
-        rows = fetch_all(oltp, "SELECT locationid AS location_nk, name AS location_name FROM production.location")
-        for r in rows:
-            execute(dw, """
-              INSERT INTO dw.dim_location(location_nk, location_name)
-              VALUES (%(location_nk)s, %(location_name)s)
-              ON CONFLICT (location_nk) DO UPDATE SET location_name = EXCLUDED.location_name
-            """, r)
-    finally:
-        oltp.close(); dw.close()
-
-def load_all_dimensions():
-    load_dim_product()
-    load_dim_customer()
-    load_dim_territory()
-    load_dim_employee()
-    load_dim_store()
-    load_dim_shipmethod()
-    load_dim_promotion()
-    load_dim_vendor()
-    load_dim_creditcard()
-    load_dim_location()
\ No newline at end of file
+        """), wm.params())
+
+        merge_scd2(dw, CUSTOMER_SCD2, wm.track(chain(rows_individual, rows_store)), valid_from=date.today())
+        wm.save(dw)
+
+
+# Dimensões SCD1: sobrescritas por NK (upsert), sem histórico
+TERRITORY_SCD1 = SCD1Spec("dw.dim_territory", "territory_nk", ("name", "country_region_code", "group"))
+EMPLOYEE_SCD1 = SCD1Spec("dw.dim_employee", "employee_nk", ("employee_name",))
+STORE_SCD1 = SCD1Spec("dw.dim_store", "store_nk", ("store_name",))
+SHIPMETHOD_SCD1 = SCD1Spec("dw.dim_shipmethod", "ship_method_nk", ("name",))
+PROMOTION_SCD1 = SCD1Spec("dw.dim_promotion", "promotion_nk", ("description", "discount_pct", "type", "category"))
+VENDOR_SCD1 = SCD1Spec("dw.dim_vendor", "vendor_nk", ("vendor_name",))
+CREDITCARD_SCD1 = SCD1Spec("dw.dim_creditcard", "credit_card_nk", ("card_type",))
+LOCATION_SCD1 = SCD1Spec("dw.dim_location", "location_nk", ("location_name",))
+
+def load_scd1(spec, extract_sql, incremental=True, pushdown=None):
+    """
+    extract_sql devolve spec.nk + spec.columns (aliases = colunas do DW) e modifieddate.
+    Só as linhas alteradas desde o watermark da dimensão são extraídas; dessas, as que têm o mesmo
+    row_hash já gravado no DW não são enviadas.
+    """
+    pipeline = spec.table.split(".")[-1]
+    sql = changed_since(extract_sql, spec.columns)
+    if pushdown_enabled(pushdown):
+        with dw_conn() as dw:
+            wm = ModifiedWatermark(dw, pipeline, incremental)
+            wm.save(dw, upsert_scd1(dw, spec, sql, wm.params()))
+        return
+    with oltp_conn() as oltp, dw_conn() as dw:
+        wm = ModifiedWatermark(dw, pipeline, incremental)
+        stored = {r["nk"]: r["row_hash"] for r in fetch_all(dw, f"SELECT {spec.nk} AS nk, row_hash FROM {spec.table}")}
+        upsert = scd1_upsert_sql(spec)
+        for batch in stream_batches(oltp, sql, wm.params()):
+            changed = [r for r in wm.observe(batch) if stored.get(r[spec.nk]) != r["row_hash"]]
+            if changed:
+                executemany(dw, upsert, changed)
+        wm.save(dw)
+
+def load_dim_territory(incremental=True, pushdown=None):
+    load_scd1(TERRITORY_SCD1, """
+      SELECT territoryid AS territory_nk, name, countryregioncode AS country_region_code, "group", modifieddate
+      FROM sales.salesterritory
+    """, incremental, pushdown)
+
+def load_dim_employee(incremental=True, pushdown=None):
+    load_scd1(EMPLOYEE_SCD1, """
+      SELECT sp.businessentityid AS employee_nk, COALESCE(p.firstname || ' ' || p.lastname, 'N/A') AS employee_name,
+             GREATEST(sp.modifieddate, p.modifieddate) AS modifieddate
+      FROM sales.salesperson sp
+      JOIN person.person p ON p.businessentityid = sp.businessentityid
+    """, incremental, pushdown)
+
+def load_dim_store(incremental=True, pushdown=None):
+    load_scd1(STORE_SCD1, """
+      SELECT businessentityid AS store_nk, name AS store_name, modifieddate
+      FROM sales.store
+    """, incremental, pushdown)
+
+def load_dim_shipmethod(incremental=True, pushdown=None):
+    load_scd1(SHIPMETHOD_SCD1, "SELECT shipmethodid AS ship_method_nk, name, modifieddate FROM purchasing.shipmethod",
+              incremental, pushdown)
+
+def load_dim_promotion(incremental=True, pushdown=None):
+    load_scd1(PROMOTION_SCD1, """
+      SELECT specialofferid AS promotion_nk, description, discountpct AS discount_pct, type, category, modifieddate
+      FROM sales.specialoffer
+    """, incremental, pushdown)
+
+def load_dim_vendor(incremental=True, pushdown=None):
+    load_scd1(VENDOR_SCD1, "SELECT businessentityid AS vendor_nk, name AS vendor_name, modifieddate FROM purchasing.vendor",
+              incremental, pushdown)
+
+def load_dim_creditcard(incremental=True, pushdown=None):
+    load_scd1(CREDITCARD_SCD1, """
+      SELECT creditcardid AS credit_card_nk, cardtype AS card_type, modifieddate FROM sales.creditcard
+    """, incremental, pushdown)
+
+def load_dim_location(incremental=True, pushdown=None):
+    load_scd1(LOCATION_SCD1, """
+      SELECT locationid AS location_nk, name AS location_name, modifieddate FROM production.location
+    """, incremental, pushdown)
+
+DIMENSION_LOADERS = [
+    ("dim_product", load_dim_product),
+    ("dim_customer", load_dim_customer),
+    ("dim_territory", load_dim_territory),
+    ("dim_employee", load_dim_employee),
+    ("dim_store", load_dim_store),
+    ("dim_shipmethod", load_dim_shipmethod),
+    ("dim_promotion", load_dim_promotion),
+    ("dim_vendor", load_dim_vendor),
+    ("dim_creditcard", load_dim_creditcard),
+    ("dim_location", load_dim_location),
+]
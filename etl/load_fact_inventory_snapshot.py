@@ -1,30 +1,111 @@
-from datetime import date
-from .db import get_conn_oltp, get_conn_dw, fetch_all, fetch_one, execute
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from .db import oltp_conn, stream_batches, copy_rows
+from .keys import KeyResolver
+from .load_dim_date import ensure_dim_date_range
+from . import overlap as ov
+from .metrics import stage, in_context
+
+log = logging.getLogger(__name__)
 
 def yyyymmdd(d): return d.year*10000 + d.month*100 + d.day
 
-def get_key(conn, sql, params):
-    r = fetch_one(conn, sql, params)
-    return r["id"] if r else None
+INVENTORY_DIM_COLUMNS = {"product": "productid", "location": "locationid"}
+
+FACT_INVENTORY_COLUMNS = ["snapshot_date_key", "product_key", "location_key", "quantity_on_hand"]
+
+def transform_inventory_batch(resolver, snapshot_date, batch):
+    date_key = yyyymmdd(snapshot_date)
+    with stage("keys"):
+        resolver.prefetch_rows(batch, INVENTORY_DIM_COLUMNS)
+    with stage("transform"):
+        rows = [(date_key, resolver.get_as_of("product", r["productid"], snapshot_date),
+                 resolver.get("location", r["locationid"]), r["quantity"])
+                for r in batch]
+        # produto/local ainda ausente do DW: a linha fica fora do snapshot (chaves NOT NULL)
+        return [row for row in rows if row[1] is not None and row[2] is not None]
+
+class PastSnapshotError(ValueError):
+    """Snapshot pedido para uma data passada, que o OLTP não tem como reconstruir."""
+
+def check_snapshot_dates(dates):
+    """
+    production.productinventory só guarda a posição atual por produto/local, e o histórico de
+    production.transactionhistory não tem a localização: gravar essa posição sob uma data passada
+    inventaria um histórico. Levanta PastSnapshotError para datas anteriores a hoje.
+    """
+    past = sorted(d for d in dates if d < date.today())
+    if past:
+        raise PastSnapshotError(
+            f"snapshot de inventário só pode ser gravado a partir de hoje ({date.today()}): "
+            f"o OLTP não guarda posições passadas ({past[0]}" + (f" .. {past[-1]})" if len(past) > 1 else ")"))
 
-def load_inventory_snapshot(snapshot_date: date):
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
+def load_inventory_snapshot(snapshot_date: date, overlap=None):
+    """
+    Grava o snapshot da data de forma idempotente: DELETE da data + COPY das linhas em uma única
+    transação (rodar duas vezes para a mesma data substitui o snapshot, não duplica).
+    Só datas a partir de hoje: production.productinventory guarda apenas a posição atual
+    (ver check_snapshot_dates). Retorna o número de linhas gravadas.
+    """
+    check_snapshot_dates([snapshot_date])
+    with oltp_conn() as oltp, ov.dw_connections(overlap) as (dw, keys_dw):
         date_key = yyyymmdd(snapshot_date)
         # Snapshot: usar production.productinventory (quantidade por product + location)
-        rows = fetch_all(oltp, """
+        batches = stream_batches(oltp, """
           SELECT productid, locationid, quantity
           FROM production.productinventory
         """)
-        for r in rows:
-            product_key = get_key(dw, "SELECT product_key AS id FROM dw.dim_product WHERE product_nk = %s AND is_current", (r["productid"],))
-            location_key = get_key(dw, "SELECT location_key AS id FROM dw.dim_location WHERE location_nk = %s", (r["locationid"],))
-            execute(dw, """
-              INSERT INTO dw.fact_inventory_snapshot(snapshot_date_key, product_key, location_key, quantity_on_hand)
-              VALUES (%s, %s, %s, %s)
-            """, (date_key, product_key, location_key, r["quantity"]))
-    finally:
-        oltp.close(); dw.close()
+        resolver = KeyResolver(keys_dw, as_of=True).preload(INVENTORY_DIM_COLUMNS)  # produto vigente na data do snapshot
+        with dw.cursor() as cur:
+            cur.execute("DELETE FROM dw.fact_inventory_snapshot WHERE snapshot_date_key = %s", (date_key,))
+        skipped = 0
+
+        def facts(items):
+            nonlocal skipped
+            for batch, rows in items:
+                skipped += len(batch) - len(rows)
+                yield from rows
+
+        loaded = ov.run(batches, lambda batch: transform_inventory_batch(resolver, snapshot_date, batch),
+                        lambda items: copy_rows(dw, "dw.fact_inventory_snapshot", FACT_INVENTORY_COLUMNS,
+                                                facts(items), commit=False), overlap)
+        dw.commit()
+        if skipped:
+            log.warning("snapshot %s: %d linhas sem produto/local no DW ficaram de fora (lookups: %s)",
+                        snapshot_date, skipped, resolver.stats())
+        return loaded
+
+def month_ends(start: date, end: date):
+    """Últimos dias de cada mês entre start e end (inclusive)."""
+    d = date(start.year, start.month, 1)
+    while d <= end:
+        nxt = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+        last = nxt - timedelta(days=1)
+        if start <= last <= end:
+            yield last
+        d = nxt
+
+def backfill_inventory_snapshots(start: date, end: date, max_workers=4):
+    """
+    Grava os snapshots de fim de mês entre start e end em paralelo (uma conexão por worker).
+    Datas passadas são recusadas antes de qualquer gravação (check_snapshot_dates): serve para agendar
+    os fins de mês a partir de hoje, não para reconstruir histórico. Retorna {data: linhas}.
+    """
+    dates = list(month_ends(start, end))
+    if not dates:
+        return {}
+    check_snapshot_dates(dates)
+    # snapshot_date_key referencia dim_date: estende o calendário antes dos workers
+    ensure_dim_date_range(dates[0], dates[-1])
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {d: pool.submit(in_context(load_inventory_snapshot), d) for d in dates}
+    return {d: f.result() for d, f in futures.items()}
 
 if __name__ == "__main__":
-    load_inventory_snapshot(date.today())
\ No newline at end of file
+    # python -m etl.load_fact_inventory_snapshot [inicio fim]  (datas ISO, a partir de hoje: fins de mês do intervalo)
+    if len(sys.argv) == 3:
+        backfill_inventory_snapshots(date.fromisoformat(sys.argv[1]), date.fromisoformat(sys.argv[2]))
+    else:
+        load_inventory_snapshot(date.today())
\ No newline at end of file
@@ -1,63 +1,135 @@
-from .db import get_conn_oltp, get_conn_dw, fetch_all, fetch_one, execute
+from .db import oltp_conn, dw_conn, stream_batches, units_of_work, execute, fetch_one, copy_rows, get_watermark, set_watermark
+from .keys import KeyResolver, lookup_sql
+from .metrics import stage
+from . import pushdown as pd
+from . import overlap as ov
 from datetime import date
 
 def yyyymmdd(d): return d.year*10000 + d.month*100 + d.day
 
-def get_key(conn, sql, params):
-    r = fetch_one(conn, sql, params)
-    return r["id"] if r else None
+PURCHASES_DIM_COLUMNS = {"product": "productid", "vendor": "vendorid", "location": "locationid"}
 
-def load_fact_purchases(truncate=False):
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
+FACT_PURCHASES_COLUMNS = [
+    "order_date_key", "vendor_key", "product_key", "location_key",
+    "purchase_order_number", "purchase_order_line_id",
+    "order_qty", "unit_price", "line_total",
+]
+# colunas regravadas pelo upsert; updated_at recebe o default (now()) da linha proposta
+PURCHASES_UPDATE_COLUMNS = [c for c in FACT_PURCHASES_COLUMNS if c != "purchase_order_line_id"] + ["updated_at"]
+
+def transform_purchase_row(resolver, r):
+    return {
+        "order_date_key": yyyymmdd(r["orderdate"]) if r["orderdate"] else None,
+        "vendor_key": resolver.get("vendor", r["vendorid"]),
+        "product_key": resolver.get_as_of("product", r["productid"], r["orderdate"]),
+        "location_key": resolver.get("location", r["locationid"]),
+        "purchase_order_number": str(r["purchaseorderid"]),
+        "purchase_order_line_id": r["purchaseorderdetailid"],
+        "order_qty": r["orderqty"],
+        "unit_price": r["unitprice"],
+        "line_total": r["line_total"],
+    }
+
+def transform_purchase_batch(resolver, batch):
+    with stage("keys"):
+        resolver.prefetch_rows(batch, PURCHASES_DIM_COLUMNS)
+    with stage("transform"):
+        return [transform_purchase_row(resolver, r) for r in batch]
+
+PURCHASES_EXTRACT_SQL = """
+    SELECT
+      d.purchaseorderdetailid,
+      h.purchaseorderid,
+      h.orderdate,
+      h.vendorid,
+      d.productid,
+      d.orderqty,
+      d.unitprice,
+      (d.orderqty * d.unitprice)::numeric(18,4) AS line_total,
+      pi.locationid,
+      GREATEST(h.modifieddate, d.modifieddate) AS modifieddate
+    FROM purchasing.purchaseorderdetail d
+    JOIN purchasing.purchaseorderheader h ON h.purchaseorderid = d.purchaseorderid
+    -- uma localização por produto (a de maior estoque): o JOIN direto por productid multiplicava as linhas
+    LEFT JOIN (
+      SELECT DISTINCT ON (productid) productid, locationid
+      FROM production.productinventory
+      ORDER BY productid, quantity DESC, locationid
+    ) pi ON pi.productid = d.productid
+    -- >= : linhas com o mesmo timestamp do watermark são relidas; o upsert por linha torna isso idempotente
+    WHERE (%(since)s IS NULL OR GREATEST(h.modifieddate, d.modifieddate) >= %(since)s)
+    -- ordem do watermark: cada checkpoint pode avançá-lo até a última linha gravada
+    ORDER BY GREATEST(h.modifieddate, d.modifieddate), d.purchaseorderdetailid
+"""
+
+PURCHASES_PUSHDOWN_COLUMNS = [
+    ("purchaseorderdetailid", "int"), ("purchaseorderid", "int"), ("orderdate", "timestamp"),
+    ("vendorid", "int"), ("productid", "int"), ("orderqty", "int"), ("unitprice", "numeric"),
+    ("line_total", "numeric"), ("locationid", "int"), ("modifieddate", "timestamp"),
+]
+
+def load_fact_purchases_pushdown(dw, since=None):
+    """
+    Upsert de fact_purchases no próprio DW (OLTP lido via dblink), mesmas regras de transform_purchase_row;
+    watermark na mesma transação. Retorna o número de linhas gravadas.
+    """
+    source = pd.remote_source(dw, PURCHASES_EXTRACT_SQL, {"since": since}, PURCHASES_PUSHDOWN_COLUMNS)
+    keys, joins = lookup_sql(PURCHASES_DIM_COLUMNS, "s", as_of="s.orderdate::date")
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in PURCHASES_UPDATE_COLUMNS)
+    with stage("pushdown"):
+        pd.run(dw, f"CREATE TEMP TABLE _pushdown_purchases ON COMMIT DROP AS SELECT * FROM {source}")
+        loaded = pd.run(dw, f"""
+            INSERT INTO dw.fact_purchases ({", ".join(FACT_PURCHASES_COLUMNS)})
+            SELECT
+              to_char(s.orderdate, 'YYYYMMDD')::int,
+              {keys["vendor"]}, {keys["product"]}, {keys["location"]},
+              s.purchaseorderid::text, s.purchaseorderdetailid,
+              s.orderqty, s.unitprice, s.line_total
+            FROM _pushdown_purchases s
+            {joins}
+            ORDER BY s.modifieddate, s.purchaseorderdetailid
+            ON CONFLICT (purchase_order_line_id) DO UPDATE SET {updates}
+        """)
+        max_modified = fetch_one(dw, "SELECT max(modifieddate) AS m FROM _pushdown_purchases")["m"]
+    if max_modified is not None:
+        set_watermark(dw, "fact_purchases", max_modified.isoformat(), commit=False)
+    dw.commit()
+    return loaded
+
+def load_fact_purchases(truncate=False, incremental=False, checkpoint_rows=None, pushdown=None, overlap=None):
+    """
+    truncate=True: recarga completa. incremental=True: somente linhas de pedido criadas/alteradas
+    desde o watermark (modifieddate) de 'fact_purchases', aplicadas com upsert por purchase_order_line_id.
+    A cada checkpoint_rows linhas as linhas e o watermark são confirmados juntos (retomada segura).
+    Com pushdown (ETL_PUSHDOWN) roda inteira no DW (load_fact_purchases_pushdown); com overlap
+    (ETL_OVERLAP) extract, transform e load rodam concorrentemente (etl.overlap).
+    """
+    if pd.enabled(pushdown):
+        with dw_conn() as dw:
+            if truncate:
+                execute(dw, "TRUNCATE TABLE dw.fact_purchases RESTART IDENTITY")
+            since = get_watermark(dw, "fact_purchases") if incremental and not truncate else None
+            load_fact_purchases_pushdown(dw, since)
+        return
+
+    with oltp_conn() as oltp, ov.dw_connections(overlap) as (dw, keys_dw):
         if truncate:
             execute(dw, "TRUNCATE TABLE dw.fact_purchases RESTART IDENTITY")
 
-        rows = fetch_all(oltp, """
-          SELECT
-            d.purchaseorderdetailid,
-            h.purchaseorderid,
-            h.orderdate,
-            h.vendorid,
-            d.productid,
-            d.orderqty,
-            d.unitprice,
-            (d.orderqty * d.unitprice)::numeric(18,4) AS line_total,
-            pi.locationid
-          FROM purchasing.purchaseorderdetail d
-          JOIN purchasing.purchaseorderheader h ON h.purchaseorderid = d.purchaseorderid
-          LEFT JOIN production.productinventory pi ON pi.productid = d.productid
-        """)
+        since = get_watermark(dw, "fact_purchases") if incremental and not truncate else None
+        resolver = KeyResolver(keys_dw, as_of=True).preload(PURCHASES_DIM_COLUMNS)
+        batches = stream_batches(oltp, PURCHASES_EXTRACT_SQL, {"since": since})
+
+        def load(items):
+            for unit in units_of_work(items, checkpoint_rows, size=lambda item: len(item[0])):
+                copy_rows(dw, "dw.fact_purchases", FACT_PURCHASES_COLUMNS,
+                          (f for _, rows in unit for f in rows),
+                          conflict_columns=["purchase_order_line_id"], update_columns=PURCHASES_UPDATE_COLUMNS,
+                          commit=False)
+                set_watermark(dw, "fact_purchases", unit[-1][0][-1]["modifieddate"].isoformat(), commit=False)
+                dw.commit()
 
-        for r in rows:
-            order_date_key = yyyymmdd(r["orderdate"]) if r["orderdate"] else None
-            product_key = get_key(dw, "SELECT product_key AS id FROM dw.dim_product WHERE product_nk = %s AND is_current", (r["productid"],))
-            vendor_key = get_key(dw, "SELECT vendor_key AS id FROM dw.dim_vendor WHERE vendor_nk = %s", (r["vendorid"],))
-            location_key = get_key(dw, "SELECT location_key AS id FROM dw.dim_location WHERE location_nk = %s", (r["locationid"],)) if r["locationid"] else None
-
-            execute(dw, """
-              INSERT INTO dw.fact_purchases(
-                order_date_key, vendor_key, product_key, location_key,
-                purchase_order_number, purchase_order_line_id,
-                order_qty, unit_price, line_total
-              ) VALUES (
-                %(order_date_key)s, %(vendor_key)s, %(product_key)s, %(location_key)s,
-                %(purchase_order_number)s, %(purchase_order_line_id)s,
-                %(order_qty)s, %(unit_price)s, %(line_total)s
-              )
-            """, {
-                "order_date_key": order_date_key,
-                "vendor_key": vendor_key,
-                "product_key": product_key,
-                "location_key": location_key,
-                "purchase_order_number": str(r["purchaseorderid"]),
-                "purchase_order_line_id": r["purchaseorderdetailid"],
-                "order_qty": r["orderqty"],
-                "unit_price": r["unitprice"],
-                "line_total": r["line_total"],
-            })
-    finally:
-        oltp.close(); dw.close()
+        ov.run(batches, lambda batch: transform_purchase_batch(resolver, batch), load, overlap)
 
 if __name__ == "__main__":
     load_fact_purchases(truncate=True)
\ No newline at end of file
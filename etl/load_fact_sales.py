@@ -1,30 +1,51 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import date
-from .db import get_conn_oltp, get_conn_dw, fetch_all, fetch_one, execute
+from .db import (oltp_conn, dw_conn, stream_batches, units_of_work, execute, fetch_one, fetch_all, copy_rows,
+                 get_watermark, set_watermark, init_worker, worker_initargs)
+from .aggregates import refresh_sales_aggregates, rebuild_sales_aggregates, seed_sales_aggregates
+from .keys import KeyResolver, lookup_sql
+from .metrics import stage, in_context
+from . import pushdown as pd
+from . import overlap as ov
+from .partitions import (month_of, month_dates, ensure_fact_sales_partitions, remember_partitions,
+                         prepare_partition_stage, swap_fact_sales_partition)
+from .transform import sales_measures, SCALE
+
+log = logging.getLogger(__name__)
 
 def yyyymmdd(d): return d.year*10000 + d.month*100 + d.day
 
-def get_key(conn, sql, params):
-    r = fetch_one(conn, sql, params)
-    return r["id"] if r else None
+# dimensão -> coluna da linha de origem com o NK
+SALES_DIM_COLUMNS = {
+    "product": "productid",
+    "customer": "customerid",
+    "territory": "territoryid",
+    "employee": "salespersonid",
+    "store": "storeid",
+    "shipmethod": "shipmethodid",
+    "promotion": "specialofferid",
+    "creditcard": "creditcardid",
+}
 
-def ensure_dim_keys(dw, row):
+def ensure_dim_keys(resolver, row):
     # Datas
     order_date_key = yyyymmdd(row["orderdate"]) if row["orderdate"] else None
     due_date_key = yyyymmdd(row["duedate"]) if row["duedate"] else None
     ship_date_key = yyyymmdd(row["shipdate"]) if row["shipdate"] else None
 
-    # Product (SCD2: pega current por NK)
-    product_key = get_key(dw, "SELECT product_key AS id FROM dw.dim_product WHERE product_nk = %s AND is_current", (row["productid"],))
-
-    # Customer (SCD2)
-    customer_key = get_key(dw, "SELECT customer_key AS id FROM dw.dim_customer WHERE customer_nk = %s AND is_current", (row["customerid"],))
+    # Product/Customer (SCD2): versão vigente na data do pedido (resolver com as_of; senão a corrente)
+    product_key = resolver.get_as_of("product", row["productid"], row["orderdate"])
+    customer_key = resolver.get_as_of("customer", row["customerid"], row["orderdate"])
 
-    territory_key = get_key(dw, "SELECT territory_key AS id FROM dw.dim_territory WHERE territory_nk = %s", (row["territoryid"],))
-    employee_key = get_key(dw, "SELECT employee_key AS id FROM dw.dim_employee WHERE employee_nk = %s", (row["salespersonid"],)) if row["salespersonid"] else None
-    store_key = get_key(dw, "SELECT store_key AS id FROM dw.dim_store WHERE store_nk = %s", (row["storeid"],)) if row["storeid"] else None
-    ship_method_key = get_key(dw, "SELECT ship_method_key AS id FROM dw.dim_shipmethod WHERE ship_method_nk = %s", (row["shipmethodid"],)) if row["shipmethodid"] else None
-    promotion_key = get_key(dw, "SELECT promotion_key AS id FROM dw.dim_promotion WHERE promotion_nk = %s", (row["specialofferid"],)) if row["specialofferid"] else None
-    credit_card_key = get_key(dw, "SELECT credit_card_key AS id FROM dw.dim_creditcard WHERE credit_card_nk = %s", (row["creditcardid"],)) if row["creditcardid"] else None
+    territory_key = resolver.get("territory", row["territoryid"])
+    employee_key = resolver.get("employee", row["salespersonid"])
+    store_key = resolver.get("store", row["storeid"])
+    ship_method_key = resolver.get("shipmethod", row["shipmethodid"])
+    promotion_key = resolver.get("promotion", row["specialofferid"])
+    credit_card_key = resolver.get("creditcard", row["creditcardid"])
 
     return {
         "order_date_key": order_date_key,
@@ -40,134 +61,401 @@ def ensure_dim_keys(dw, row):
         "credit_card_key": credit_card_key,
     }
 
-def load_fact_sales(incremental=True):
-    oltp = get_conn_oltp(); dw = get_conn_dw()
-    try:
+FACT_SALES_COLUMNS = [
+    "order_date_key", "due_date_key", "ship_date_key",
+    "customer_key", "product_key", "territory_key", "employee_key", "store_key", "ship_method_key",
+    "promotion_key", "credit_card_key",
+    "sales_order_number", "sales_order_line_id",
+    "order_qty", "unit_price", "unit_price_discount",
+    "line_subtotal", "tax_amount_alloc", "freight_amount_alloc", "total_due_line",
+    "standard_cost_amount", "gross_margin_amount", "shipping_days", "on_time_delivery",
+]
+
+SALES_EXTRACT_SQL = """
+    WITH base AS (
+      SELECT
+        d.salesorderdetailid,
+        d.salesorderid,
+        h.salesordernumber,
+        h.orderdate, h.duedate, h.shipdate,
+        h.taxamt, h.freight, h.subtotal AS order_subtotal,
+        h.creditcardid, h.territoryid, h.shipmethodid,
+        h.salespersonid,
+        c.customerid,
+        c.storeid,
+        d.productid,
+        d.orderqty,
+        d.unitprice,
+        d.unitpricediscount,
+        d.linetotal,
+        -- promoção da própria linha (um join com specialofferproduct só por productid multiplicaria a linha
+        -- por oferta do produto)
+        d.specialofferid
+      FROM sales.salesorderdetail d
+      JOIN sales.salesorderheader h ON h.salesorderid = d.salesorderid
+      JOIN sales.customer c ON c.customerid = h.customerid
+      WHERE (%(last_id)s IS NULL OR d.salesorderdetailid > %(last_id)s)
+        AND (%(max_id)s IS NULL OR d.salesorderdetailid <= %(max_id)s)
+        AND (%(date_from)s IS NULL OR h.orderdate >= %(date_from)s)
+        AND (%(date_to)s IS NULL OR h.orderdate < %(date_to)s)
+    ),
+    lines AS (
+      SELECT
+        b.*,
+        -- Subtotal por linha calculado via unitprice e desconto (garante consistência)
+        (b.orderqty * b.unitprice * (1 - b.unitpricediscount))::numeric(18,4) AS line_subtotal_calc
+      FROM base b
+    ),
+    alloc AS (
+      SELECT
+        l.*,
+        CASE WHEN NULLIF(l.order_subtotal, 0) IS NULL THEN 0
+             ELSE (l.line_subtotal_calc / l.order_subtotal) * l.taxamt END AS tax_alloc,
+        CASE WHEN NULLIF(l.order_subtotal, 0) IS NULL THEN 0
+             ELSE (l.line_subtotal_calc / l.order_subtotal) * l.freight END AS freight_alloc
+      FROM lines l
+    )
+    SELECT
+      a.*,
+      -- medidas em ponto fixo (x 10^4) e datas em segundos para a transformação colunar
+      (a.line_subtotal_calc * 10000)::bigint AS line_subtotal_fx,
+      -- total da linha somado sobre os valores sem arredondar e arredondado uma única vez
+      ((COALESCE(a.line_subtotal_calc, 0) + COALESCE(a.tax_alloc, 0) + COALESCE(a.freight_alloc, 0)) * 10000)::bigint
+        AS total_due_fx,
+      floor(extract(epoch FROM a.orderdate))::bigint AS orderdate_ts,
+      floor(extract(epoch FROM a.duedate))::bigint AS duedate_ts,
+      floor(extract(epoch FROM a.shipdate))::bigint AS shipdate_ts
+    FROM alloc a
+    ORDER BY a.salesorderdetailid
+"""
+
+def transform_sales_batch(resolver, batch):
+    with stage("keys"):
+        resolver.prefetch_rows(batch, SALES_DIM_COLUMNS)
+        keyed = [(ensure_dim_keys(resolver, r), r) for r in batch]
+        keyed = [(keys, r) for keys, r in keyed if keys["order_date_key"]]
+        if not keyed:
+            return []
+        costs = [resolver.get_standard_cost(keys["product_key"]) for keys, _ in keyed]
+
+    # medidas derivadas calculadas em bloco (custo padrão da versão do produto vigente no pedido)
+    with stage("transform"):
+        measures = sales_measures([r for _, r in keyed], costs)
+        return [{
+            **keys,
+            "sales_order_number": r["salesordernumber"],
+            "sales_order_line_id": r["salesorderdetailid"],
+            "order_qty": r["orderqty"],
+            "unit_price": r["unitprice"],
+            "unit_price_discount": r["unitpricediscount"],
+            "line_subtotal": r["line_subtotal_calc"] or 0,
+            "tax_amount_alloc": r["tax_alloc"] or 0,
+            "freight_amount_alloc": r["freight_alloc"] or 0,
+            **{col: values[i] for col, values in measures.items()},
+        } for i, (keys, r) in enumerate(keyed)]
+
+def extract_params(last_id=None, max_id=None, date_from=None, date_to=None):
+    return {"last_id": last_id, "max_id": max_id, "date_from": date_from, "date_to": date_to}
+
+def load_fact_sales(incremental=True, checkpoint_rows=None, pushdown=None, overlap=None):
+    """
+    Carga incremental por unidades de trabalho: a cada checkpoint_rows linhas (ETL_CHECKPOINT_ROWS)
+    as linhas, o watermark e os agregados dos meses tocados são confirmados em uma única transação.
+    Uma execução interrompida perde no máximo a unidade corrente e a próxima (incremental) retoma
+    do último checkpoint, sem duplicar linhas. Com pushdown (ETL_PUSHDOWN) a carga roda inteira no DW
+    (load_fact_sales_pushdown); com overlap (ETL_OVERLAP) extract, transform e load rodam
+    concorrentemente (etl.overlap). Retorna o número de linhas carregadas.
+    """
+    with dw_conn() as dw:
+        # agregados ainda não semeados: os checkpoints abaixo só recalculam os meses que recebem linhas
+        with stage("aggregates"):
+            seed_sales_aggregates(dw)
+    if pd.enabled(pushdown):
+        with dw_conn() as dw:
+            return load_fact_sales_pushdown(dw, last_sales_id(dw) if incremental else None)
+
+    with oltp_conn() as oltp, ov.dw_connections(overlap) as (dw, keys_dw):
         # Watermark por SalesOrderDetailID
-        last_id = None
-        if incremental:
-            rc = fetch_one(dw, "SELECT last_watermark_value FROM dw.etl_run_control WHERE pipeline_name = 'fact_sales'")
-            if rc and rc["last_watermark_value"]:
-                last_id = int(rc["last_watermark_value"])
-
-        rows = fetch_all(oltp, f"""
-          WITH base AS (
-            SELECT
-              d.salesorderdetailid,
-              d.salesorderid,
-              h.salesordernumber,
-              h.orderdate, h.duedate, h.shipdate,
-              h.taxamt, h.freight, h.subtotal AS order_subtotal,
-              h.creditcardid, h.territoryid, h.shipmethodid,
-              h.salespersonid,
-              c.customerid,
-              c.storeid,
-              d.productid,
-              d.orderqty,
-              d.unitprice,
-              d.unitpricediscount,
-              d.linetotal,
-              so.specialofferid
-            FROM sales.salesorderdetail d
-            JOIN sales.salesorderheader h ON h.salesorderid = d.salesorderid
-            JOIN sales.customer c ON c.customerid = h.customerid
-            LEFT JOIN sales.specialofferproduct sop ON sop.productid = d.productid
-            LEFT JOIN sales.specialoffer so ON so.specialofferid = sop.specialofferid
-            WHERE (%(last_id)s IS NULL OR d.salesorderdetailid > %(last_id)s)
-          ),
-          lines AS (
-            SELECT
-              b.*,
-              -- Subtotal por linha calculado via unitprice e desconto (garante consistência)
-              (b.orderqty * b.unitprice * (1 - b.unitpricediscount))::numeric(18,4) AS line_subtotal_calc
-            FROM base b
-          ),
-          alloc AS (
-            SELECT
-              l.*,
-              CASE WHEN NULLIF(l.order_subtotal, 0) IS NULL THEN 0
-                   ELSE (l.line_subtotal_calc / l.order_subtotal) * l.taxamt END AS tax_alloc,
-              CASE WHEN NULLIF(l.order_subtotal, 0) IS NULL THEN 0
-                   ELSE (l.line_subtotal_calc / l.order_subtotal) * l.freight END AS freight_alloc
-            FROM lines l
-          )
-          SELECT * FROM alloc
-          ORDER BY salesorderdetailid
-        """, {"last_id": last_id})
-
-        # Inserção
-        for r in rows:
-            keys = ensure_dim_keys(dw, r)
-            if not keys["order_date_key"]:
-                continue
-
-            # custo padrão do produto vigente
-            stdc = fetch_one(dw, """
-              SELECT standard_cost FROM dw.dim_product
-              WHERE product_key = %s
-            """, (keys["product_key"],))
-            standard_cost = stdc["standard_cost"] if stdc else 0
-            standard_cost_amount = float(standard_cost or 0) * float(r["orderqty"] or 0)
-
-            line_subtotal = float(r["line_subtotal_calc"] or 0)
-            tax_alloc = float(r["tax_alloc"] or 0)
-            freight_alloc = float(r["freight_alloc"] or 0)
-            total_due_line = line_subtotal + tax_alloc + freight_alloc
-            gross_margin_amount = line_subtotal - standard_cost_amount
-
-            shipping_days = None
-            if r["orderdate"] and r["shipdate"]:
-                shipping_days = (r["shipdate"] - r["orderdate"]).days
-            on_time_delivery = None
-            if r["duedate"] and r["shipdate"]:
-                on_time_delivery = r["shipdate"] <= r["duedate"]
-
-            execute(dw, """
-              INSERT INTO dw.fact_sales(
-                order_date_key, due_date_key, ship_date_key,
-                customer_key, product_key, territory_key, employee_key, store_key, ship_method_key,
-                promotion_key, credit_card_key,
-                sales_order_number, sales_order_line_id,
-                order_qty, unit_price, unit_price_discount,
-                line_subtotal, tax_amount_alloc, freight_amount_alloc, total_due_line,
-                standard_cost_amount, gross_margin_amount, shipping_days, on_time_delivery
-              ) VALUES (
-                %(order_date_key)s, %(due_date_key)s, %(ship_date_key)s,
-                %(customer_key)s, %(product_key)s, %(territory_key)s, %(employee_key)s, %(store_key)s, %(ship_method_key)s,
-                %(promotion_key)s, %(credit_card_key)s,
-                %(sales_order_number)s, %(salesorderdetailid)s,
-                %(orderqty)s, %(unitprice)s, %(unitpricediscount)s,
-                %(line_subtotal)s, %(tax_alloc)s, %(freight_alloc)s, %(total_due_line)s,
-                %(standard_cost_amount)s, %(gross_margin_amount)s, %(shipping_days)s, %(on_time_delivery)s
-              )
-            """, {
-                **keys,
-                "sales_order_number": r["salesordernumber"],
-                "salesorderdetailid": r["salesorderdetailid"],
-                "orderqty": r["orderqty"],
-                "unitprice": r["unitprice"],
-                "unitpricediscount": r["unitpricediscount"],
-                "line_subtotal": line_subtotal,
-                "tax_alloc": tax_alloc,
-                "freight_alloc": freight_alloc,
-                "total_due_line": total_due_line,
-                "standard_cost_amount": standard_cost_amount,
-                "gross_margin_amount": gross_margin_amount,
-                "shipping_days": shipping_days,
-                "on_time_delivery": on_time_delivery,
-            })
-
-        # Atualiza watermark
-        if rows:
-            max_id = max(r["salesorderdetailid"] for r in rows)
-            execute(dw, """
-              INSERT INTO dw.etl_run_control(pipeline_name, last_watermark_value)
-              VALUES ('fact_sales', %s)
-              ON CONFLICT (pipeline_name) DO UPDATE
-                SET last_watermark_value = EXCLUDED.last_watermark_value, updated_at = now()
-            """, (str(max_id),))
-    finally:
-        oltp.close(); dw.close()
-
-if __name__ == "__main__":
-    load_fact_sales()
\ No newline at end of file
+        last_id = last_sales_id(dw) if incremental else None
+
+        # Pipeline: extração em lotes (cursor server-side) -> transformação -> COPY (roteado para as partições)
+        resolver = KeyResolver(keys_dw, as_of=True).preload(SALES_DIM_COLUMNS)
+        batches = stream_batches(oltp, SALES_EXTRACT_SQL, extract_params(last_id=last_id))
+        return ov.run(batches, lambda batch: transform_sales_batch(resolver, batch),
+                      lambda items: _load_units(dw, items, "fact_sales", checkpoint_rows), overlap)
+
+def last_sales_id(dw):
+    wm = get_watermark(dw, "fact_sales")
+    return int(wm) if wm else None
+
+# Colunas de SALES_EXTRACT_SQL lidas pelo modo pushdown (tipos do registro devolvido pelo dblink)
+SALES_PUSHDOWN_COLUMNS = [
+    ("salesorderdetailid", "int"), ("salesordernumber", "text"),
+    ("orderdate", "timestamp"), ("duedate", "timestamp"), ("shipdate", "timestamp"),
+    ("productid", "int"), ("customerid", "int"), ("territoryid", "int"), ("salespersonid", "int"),
+    ("storeid", "int"), ("shipmethodid", "int"), ("specialofferid", "int"), ("creditcardid", "int"),
+    ("orderqty", "int"), ("unitprice", "numeric"), ("unitpricediscount", "numeric"),
+    ("line_subtotal_calc", "numeric"), ("tax_alloc", "numeric"), ("freight_alloc", "numeric"),
+    ("line_subtotal_fx", "bigint"), ("total_due_fx", "bigint"),
+    ("orderdate_ts", "bigint"), ("duedate_ts", "bigint"), ("shipdate_ts", "bigint"),
+]
+
+def sales_pushdown_insert(source="_pushdown_sales"):
+    """
+    INSERT ... SELECT de fact_sales a partir das linhas extraídas em source, com as mesmas regras de
+    transform_sales_batch + sales_measures: lookups como o KeyResolver, medidas em ponto fixo (x 10^4),
+    dias de entrega por floor da diferença em segundos, linhas sem orderdate descartadas.
+    """
+    keys, joins = lookup_sql(SALES_DIM_COLUMNS, "s", as_of="s.orderdate::date")
+    cost = f"round(COALESCE(k_product.standard_cost, 0), {SCALE}) * COALESCE(s.orderqty, 0)"
+    return f"""
+        INSERT INTO dw.fact_sales ({", ".join(FACT_SALES_COLUMNS)})
+        SELECT
+          to_char(s.orderdate, 'YYYYMMDD')::int,
+          to_char(s.duedate, 'YYYYMMDD')::int,
+          to_char(s.shipdate, 'YYYYMMDD')::int,
+          {keys["customer"]}, {keys["product"]}, {keys["territory"]}, {keys["employee"]}, {keys["store"]},
+          {keys["shipmethod"]}, {keys["promotion"]}, {keys["creditcard"]},
+          s.salesordernumber, s.salesorderdetailid,
+          s.orderqty, s.unitprice, s.unitpricediscount,
+          COALESCE(s.line_subtotal_calc, 0), COALESCE(s.tax_alloc, 0), COALESCE(s.freight_alloc, 0),
+          COALESCE(s.total_due_fx, 0) * 0.0001,
+          {cost},
+          COALESCE(s.line_subtotal_fx, 0) * 0.0001 - {cost},
+          CASE WHEN s.orderdate_ts IS NOT NULL AND s.shipdate_ts IS NOT NULL
+               THEN floor((s.shipdate_ts - s.orderdate_ts) / 86400.0)::int END,
+          CASE WHEN s.duedate_ts IS NOT NULL AND s.shipdate_ts IS NOT NULL
+               THEN s.shipdate_ts <= s.duedate_ts END
+        FROM {source} s
+        {joins}
+        WHERE s.orderdate IS NOT NULL
+        ORDER BY s.salesorderdetailid
+    """
+
+def load_fact_sales_pushdown(dw, last_id=None):
+    """
+    Carga de fact_sales no próprio DW: as linhas acima de last_id são lidas do OLTP via dblink para uma
+    tabela temporária e gravadas com um INSERT ... SELECT; partições, watermark e agregados na mesma
+    transação. Sem idas ao cliente por linha. Retorna o número de linhas carregadas.
+    """
+    source = pd.remote_source(dw, SALES_EXTRACT_SQL, extract_params(last_id=last_id), SALES_PUSHDOWN_COLUMNS)
+    with stage("pushdown"):
+        pd.run(dw, f"CREATE TEMP TABLE _pushdown_sales ON COMMIT DROP AS SELECT * FROM {source}")
+        r = fetch_one(dw, """
+            SELECT max(salesorderdetailid) AS max_id,
+                   array_agg(DISTINCT to_char(orderdate, 'YYYYMM')::int) FILTER (WHERE orderdate IS NOT NULL) AS months
+              FROM _pushdown_sales
+        """)
+        months = r["months"] or []
+        ensure_fact_sales_partitions(dw, months)
+        loaded = pd.run(dw, sales_pushdown_insert())
+    if r["max_id"] is not None:
+        set_watermark(dw, "fact_sales", r["max_id"], commit=False)
+    with stage("aggregates"):
+        refresh_sales_aggregates(dw, months, commit=False)
+    dw.commit()
+    remember_partitions(months)
+    return loaded
+
+def _load_units(dw, items, pipeline, checkpoint_rows=None, aggregates=True):
+    """
+    Grava os pares (lote extraído, linhas de fato transformadas) de ov.run em unidades de trabalho:
+    COPY + watermark de pipeline (+ agregados dos meses tocados, se aggregates) e commit.
+    Retorna o número de linhas carregadas.
+    """
+    loaded = 0
+    for unit in units_of_work(items, checkpoint_rows, size=lambda item: len(item[0])):
+        touched = set()  # meses (yyyymm) que receberam linhas nesta unidade
+
+        def facts():
+            for _, rows in unit:
+                months = {month_of(f["order_date_key"]) for f in rows}
+                ensure_fact_sales_partitions(dw, months - touched)
+                touched.update(months)
+                yield from rows
+
+        loaded += copy_rows(dw, "dw.fact_sales", FACT_SALES_COLUMNS, facts(), commit=False)
+        # checkpoint: watermark (extração ordenada por salesorderdetailid) e agregados na mesma transação
+        set_watermark(dw, pipeline, unit[-1][0][-1]["salesorderdetailid"], commit=False)
+        if aggregates:
+            with stage("aggregates"):
+                refresh_sales_aggregates(dw, touched, commit=False)
+        dw.commit()
+        remember_partitions(touched)  # partições criadas nesta unidade já confirmadas
+    return loaded
+
+def source_months(oltp, max_id=None):
+    rows = fetch_all(oltp, """
+      SELECT DISTINCT (extract(year FROM h.orderdate) * 100 + extract(month FROM h.orderdate))::int AS yyyymm
+      FROM sales.salesorderheader h
+      WHERE h.orderdate IS NOT NULL
+        AND (%(max_id)s IS NULL OR EXISTS (
+              SELECT 1 FROM sales.salesorderdetail d
+              WHERE d.salesorderid = h.salesorderid AND d.salesorderdetailid <= %(max_id)s))
+      ORDER BY 1
+    """, {"max_id": max_id})
+    return [r["yyyymm"] for r in rows]
+
+def load_fact_sales_month(yyyymm, max_id=None, overlap=None, aggregates=True):
+    """
+    (Re)carrega um mês inteiro de fact_sales: carrega uma tabela de staging com as linhas do mês
+    e a troca pela partição (swap), sem DELETE; em seguida recalcula os agregados do mês (aggregates=False:
+    o chamador recalcula, p.ex. load_fact_sales_partitioned, uma vez para todos os meses).
+    Retorna o número de linhas carregadas.
+    """
+    date_from, date_to = month_dates(yyyymm)
+    with oltp_conn() as oltp, ov.dw_connections(overlap) as (dw, keys_dw):
+        resolver = KeyResolver(keys_dw, as_of=True).preload(SALES_DIM_COLUMNS)
+        part_stage = prepare_partition_stage(dw, yyyymm)
+        batches = stream_batches(oltp, SALES_EXTRACT_SQL,
+                                 extract_params(max_id=max_id, date_from=date_from, date_to=date_to))
+        loaded = ov.run(batches, lambda batch: transform_sales_batch(resolver, batch),
+                        lambda items: copy_rows(dw, part_stage, FACT_SALES_COLUMNS,
+                                                (f for _, rows in items for f in rows)), overlap)
+        with stage("swap"):
+            swap_fact_sales_partition(dw, yyyymm, part_stage)
+        if aggregates:
+            with stage("aggregates"):
+                refresh_sales_aggregates(dw, [yyyymm])
+        return loaded
+
+def load_fact_sales_partitioned(months=None, max_workers=4, overlap=None):
+    """
+    Carga full de fact_sales partição a partição: cada mês é extraído, transformado e gravado
+    em paralelo (uma conexão OLTP/DW por worker; com overlap, duas no DW). Sem months, recarrega
+    todos os meses do OLTP e avança o watermark até o maior SalesOrderDetailID existente no início da carga.
+    """
+    with oltp_conn() as oltp:
+        max_id = fetch_one(oltp, "SELECT max(salesorderdetailid) AS id FROM sales.salesorderdetail")["id"]
+        full = months is None
+        if full:
+            months = source_months(oltp, max_id)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {yyyymm: pool.submit(in_context(load_fact_sales_month), yyyymm, max_id, overlap, False) for yyyymm in months}
+    loaded = {yyyymm: f.result() for yyyymm, f in futures.items()}
+
+    with dw_conn() as dw:
+        if full and max_id is not None:
+            set_watermark(dw, "fact_sales", max_id, commit=False)  # confirmado com os agregados
+        with stage("aggregates"):
+            if not seed_sales_aggregates(dw):  # sem agregados: reconstrói todos os meses, não só os recarregados
+                refresh_sales_aggregates(dw, loaded)
+    return loaded
+
+# Carga full paralela por faixas de salesorderdetailid, um processo por faixa.
+# O plano (faixas) e o progresso de cada faixa ficam em dw.etl_run_control, um registro por faixa:
+# pipeline 'fact_sales_range_<lo>_<hi>' (faixa (lo, hi]) com o último id confirmado. Uma faixa que
+# falhou é retomada do seu checkpoint, isoladamente, sem recarregar as demais.
+
+RANGE_PREFIX = "fact_sales_range_"
+
+class FactSalesRangeError(Exception):
+    """Faixas que falharam mesmo após as novas tentativas; errors = [((lo, hi), exceção)]."""
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"({lo}, {hi}]: {exc!r}" for (lo, hi), exc in errors))
+
+def range_pipeline(lo, hi):
+    return f"{RANGE_PREFIX}{lo}_{hi}"
+
+def plan_ranges(oltp, workers, max_id):
+    """Divide (0, max_id] em até workers faixas com o mesmo número de linhas (percentis de salesorderdetailid)."""
+    fractions = [i / workers for i in range(1, workers)]
+    bounds = []
+    if fractions:
+        bounds = fetch_one(oltp, """
+          SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY salesorderdetailid) AS bounds
+          FROM sales.salesorderdetail
+          WHERE salesorderdetailid <= %s
+        """, (fractions, max_id))["bounds"] or []
+    edges = [0, *sorted({b for b in bounds if b is not None and b < max_id}), max_id]
+    return list(zip(edges, edges[1:]))
+
+def saved_ranges(dw):
+    """Plano gravado: [(lo, hi, último id confirmado)]."""
+    rows = fetch_all(dw, """
+      SELECT pipeline_name, last_watermark_value FROM dw.etl_run_control WHERE pipeline_name LIKE %s
+    """, (RANGE_PREFIX + "%",))
+    ranges = []
+    for r in rows:
+        lo, hi = (int(v) for v in r["pipeline_name"][len(RANGE_PREFIX):].split("_"))
+        ranges.append((lo, hi, int(r["last_watermark_value"])))
+    return sorted(ranges)
+
+def load_fact_sales_range(lo, hi, checkpoint_rows=None, overlap=None):
+    """
+    Worker: carrega a faixa (lo, hi] a partir do seu último checkpoint, em unidades de trabalho.
+    Os agregados ficam para o coordenador (vários processos atualizariam os mesmos meses).
+    Retorna o número de linhas carregadas.
+    """
+    with oltp_conn() as oltp, ov.dw_connections(overlap) as (dw, keys_dw):
+        pipeline = range_pipeline(lo, hi)
+        last_id = int(get_watermark(dw, pipeline) or lo)
+        if last_id >= hi:
+            return 0
+        resolver = KeyResolver(keys_dw, as_of=True).preload(SALES_DIM_COLUMNS)
+        batches = stream_batches(oltp, SALES_EXTRACT_SQL, extract_params(last_id=last_id, max_id=hi))
+        loaded = ov.run(batches, lambda batch: transform_sales_batch(resolver, batch),
+                        lambda items: _load_units(dw, items, pipeline, checkpoint_rows, aggregates=False), overlap)
+        set_watermark(dw, pipeline, hi)  # faixa concluída (mesmo com lacunas de id no fim)
+        return loaded
+
+def load_fact_sales_ranges(workers=None, resume=False, retries=1, checkpoint_rows=None, overlap=None):
+    """
+    Carga full de fact_sales em paralelo por faixas de salesorderdetailid, um processo (spawn) por faixa,
+    cada um com as suas conexões. Sem resume: esvazia fact_sales e grava um novo plano de workers faixas
+    (default: núcleos da máquina). Com resume: executa só as faixas pendentes do plano gravado.
+    Faixas que falham são reexecutadas (a partir do checkpoint) até retries vezes; persistindo a falha,
+    levanta FactSalesRangeError e o plano fica gravado para um resume. Ao final recalcula os agregados,
+    avança o watermark de 'fact_sales' e remove o plano. Retorna {(lo, hi): linhas}.
+    """
+    workers = workers or os.cpu_count() or 1
+    with oltp_conn() as oltp, dw_conn() as dw:
+        if resume:
+            plan = saved_ranges(dw)
+            if not plan:
+                return {}
+            todo = [(lo, hi) for lo, hi, done in plan if done < hi]
+            max_id = max(hi for _, hi, _ in plan)
+        else:
+            max_id = fetch_one(oltp, "SELECT max(salesorderdetailid) AS id FROM sales.salesorderdetail")["id"]
+            if max_id is None:
+                return {}
+            todo = plan_ranges(oltp, workers, max_id)
+            execute(dw, "TRUNCATE TABLE dw.fact_sales", commit=False)
+            execute(dw, "DELETE FROM dw.etl_run_control WHERE pipeline_name LIKE %s", (RANGE_PREFIX + "%",),
+                    commit=False)
+            for lo, hi in todo:
+                set_watermark(dw, range_pipeline(lo, hi), lo, commit=False)
+            # partições criadas antes: processos concorrentes não disputam o mesmo CREATE
+            months = ensure_fact_sales_partitions(dw, source_months(oltp, max_id))
+            dw.commit()
+            remember_partitions(months)
+
+    loaded, errors = {}, []
+    context = multiprocessing.get_context("spawn")
+    for attempt in range(retries + 1):
+        if not todo:
+            break
+        # pool novo a cada tentativa: um worker morto inutiliza o pool inteiro
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)), mp_context=context,
+                                 initializer=init_worker, initargs=worker_initargs()) as pool:
+            futures = {r: pool.submit(load_fact_sales_range, *r, checkpoint_rows, overlap) for r in todo}
+        errors = [(r, f.exception()) for r, f in futures.items() if f.exception() is not None]
+        for r, f in futures.items():
+            if f.exception() is None:
+                loaded[r] = f.result()
+        for r, exc in errors:
+            log.warning("faixa (%s, %s] falhou (tentativa %d): %r", *r, attempt + 1, exc)
+        todo = [r for r, _ in errors]
+    if errors:
+        raise FactSalesRangeError(errors)
+
+    with dw_conn() as dw:
+        with stage("aggregates"):
+            rebuild_sales_aggregates(dw)
+        set_watermark(dw, "fact_sales", max_id, commit=False)
+        execute(dw, "DELETE FROM dw.etl_run_control WHERE pipeline_name LIKE %s", (RANGE_PREFIX + "%",), commit=False)
+        dw.commit()
+    return loaded
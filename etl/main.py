@@ -1,27 +1,111 @@
+import logging
 from datetime import date
-from .load_dim_date import load_dim_date
-from .load_dimensions import load_all_dimensions
-from .load_fact_sales import load_fact_sales
-from .load_fact_purchases import load_fact_purchases
-from .load_fact_inventory_snapshot import load_inventory_snapshot
-
-def full_load():
-    # Datas (ajuste range conforme seu OLTP)
-    load_dim_date()
-    # Dimensões
-    load_all_dimensions()
-    # Fatos
-    load_fact_sales(incremental=False)   # primeira carga pode ser full
-    load_fact_purchases(truncate=True)
-    # Snapshot de inventário da data corrente (ou fim do mês)
-    load_inventory_snapshot(date.today())
-
-def daily_incremental():
-    load_all_dimensions()            # mantém dims atualizadas (SCD2 em produto/cliente)
-    load_fact_sales(incremental=True)
-    # compras e inventário podem ser agendados conforme necessidade
-    # load_fact_purchases(truncate=False)  # Ex.: implementar watermark semelhante ao sales
-    # load_inventory_snapshot(date.today())
+from functools import partial
+from . import metrics
+from . import bulk_load
+from .db import dw_conn
+from .dag import Node, DagFailed, run_graph
+from .load_dim_date import ensure_dim_date_range
+from .load_dimensions import DIMENSION_LOADERS
+from .load_fact_sales import load_fact_sales, load_fact_sales_ranges, saved_ranges, SALES_DIM_COLUMNS
+from .load_fact_purchases import load_fact_purchases, PURCHASES_DIM_COLUMNS
+from .load_fact_inventory_snapshot import load_inventory_snapshot, INVENTORY_DIM_COLUMNS
+from .export_parquet import export_star_schema
+
+log = logging.getLogger(__name__)
+
+# Cada execução é registrada em dw.etl_run_history (tempo, linhas, idas ao banco e pico de RSS por etapa)
+# e roda como um grafo de dependências (etl.dag): cada fato espera só as dimensões que resolve.
+
+# tabelas do OLTP lidas por cada loader (assinatura de entrada do nó)
+DIMENSION_SOURCES = {
+    "dim_product": ("production.product", "production.productsubcategory", "production.productcategory"),
+    "dim_customer": ("sales.customer", "person.person", "person.emailaddress", "person.personphone", "sales.store"),
+    "dim_territory": ("sales.salesterritory",),
+    "dim_employee": ("sales.salesperson", "person.person"),
+    "dim_store": ("sales.store",),
+    "dim_shipmethod": ("purchasing.shipmethod",),
+    "dim_promotion": ("sales.specialoffer",),
+    "dim_vendor": ("purchasing.vendor",),
+    "dim_creditcard": ("sales.creditcard",),
+    "dim_location": ("production.location",),
+}
+SALES_SOURCES = ("sales.salesorderheader", "sales.salesorderdetail", "sales.customer")
+PURCHASES_SOURCES = ("purchasing.purchaseorderheader", "purchasing.purchaseorderdetail", "production.productinventory")
+INVENTORY_SOURCES = ("production.productinventory",)
+
+def fact_deps(dim_columns):
+    """dim_date e as dimensões resolvidas pelo fato (chaves do seu *_DIM_COLUMNS)."""
+    return ("dim_date", *(f"dim_{dim}" for dim in dim_columns))
+
+def dimension_nodes():
+    return [Node("dim_date", lambda: ensure_dim_date_range(date.today()), always=True),
+            *(Node(name, loader, sources=DIMENSION_SOURCES[name]) for name, loader in DIMENSION_LOADERS)]
+
+def load_fact_sales_full(resume=True):
+    """
+    Carga full de fact_sales por faixas. Com resume e um plano de faixas gravado (carga anterior
+    interrompida), conclui só as faixas pendentes a partir dos seus checkpoints; sem plano, esvazia
+    fact_sales e carrega com um plano novo.
+    """
+    with dw_conn() as dw:
+        pending = resume and bool(saved_ranges(dw))
+    return load_fact_sales_ranges(resume=pending)
+
+def full_load_graph(bulk=None, resume=True):
+    # bulk_prepare/bulk_restore rodam sempre: numa retomada os índices caem de novo antes dos fatos pendentes
+    facts = ("fact_sales", "fact_purchases", "fact_inventory_snapshot")
+    return [
+        *dimension_nodes(),
+        Node("bulk_prepare", lambda: bulk_load.enabled(bulk) and bulk_load.prepare(), always=True),
+        # faixas de id em paralelo, um processo por núcleo; na retomada, só as faixas pendentes
+        Node("fact_sales", partial(load_fact_sales_full, resume),
+             (*fact_deps(SALES_DIM_COLUMNS), "bulk_prepare"), SALES_SOURCES),
+        Node("fact_purchases", partial(load_fact_purchases, truncate=True),
+             (*fact_deps(PURCHASES_DIM_COLUMNS), "bulk_prepare"), PURCHASES_SOURCES),
+        # Snapshot de inventário da data corrente (ou fim do mês)
+        Node("fact_inventory_snapshot", partial(load_inventory_snapshot, date.today()),
+             (*fact_deps(INVENTORY_DIM_COLUMNS), "bulk_prepare"), INVENTORY_SOURCES),
+        Node("bulk_restore", lambda: bulk_load.enabled(bulk) and bulk_load.restore(), facts, always=True),
+        # Parquet para os dashboards (ETL_EXPORT_DIR): todos os meses
+        Node("export", partial(export_star_schema, full=True), ("bulk_restore",)),
+    ]
+
+def daily_incremental_graph():
+    return [
+        *dimension_nodes(),  # SCD2 em produto/cliente; dim_date com as novas datas de pedidos
+        Node("fact_sales", partial(load_fact_sales, incremental=True), fact_deps(SALES_DIM_COLUMNS), SALES_SOURCES),
+        # watermark por modifieddate + upsert por linha de pedido
+        Node("fact_purchases", partial(load_fact_purchases, incremental=True), fact_deps(PURCHASES_DIM_COLUMNS),
+             PURCHASES_SOURCES),
+        # inventário pode ser agendado conforme necessidade (load_inventory_snapshot)
+        Node("export", export_star_schema, ("fact_sales", "fact_purchases")),  # só os meses que receberam linhas
+    ]
+
+def full_load(bulk=None, resume=True):
+    """
+    bulk (default ETL_BULK_LOAD): fatos carregados sem índices secundários/FKs, recriados ao final.
+    resume: após uma falha, a próxima chamada roda só os nós que falharam ou não chegaram a rodar.
+    """
+    with metrics.run("full_load") as run:
+        try:
+            run_graph("full_load", full_load_graph(bulk, resume), skip_unchanged=False, resume=resume)
+        except DagFailed:
+            # não deixa o DW sem índices até a retomada (se falhar, python -m etl.bulk_load --restore)
+            if bulk_load.enabled(bulk):
+                try:
+                    bulk_load.restore()
+                except Exception as exc:
+                    log.error("restauração de índices/FKs falhou (python -m etl.bulk_load --restore): %r", exc)
+            raise
+    return run
+
+def daily_incremental(resume=True):
+    """Nós cujas tabelas de origem (e dependências) não mudaram desde o último sucesso são pulados."""
+    with metrics.run("daily_incremental") as run:
+        run_graph("daily_incremental", daily_incremental_graph(), skip_unchanged=True, resume=resume)
+    return run
 
 if __name__ == "__main__":
-    full_load()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    full_load()
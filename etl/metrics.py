@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows: sem pico de RSS
+    resource = None
+
+# Instrumentação das execuções do ETL.
+# - run(nome): uma execução (full_load, daily_incremental...). Ao final grava uma linha em
+#   dw.etl_run_history e emite o relatório JSON (log e, com ETL_REPORT_DIR, um arquivo por execução).
+# - stage(nome): etapa dentro da execução; etapas aninhadas viram "pai.filho". Reentrar na mesma
+#   etapa (p.ex. a cada lote) acumula tempo, linhas e idas ao banco no mesmo registro.
+# - count_rows / count_round_trip: contabilizam em todas as etapas ativas no contexto corrente.
+# O contexto (execução/etapas) não passa sozinho para threads de um pool: use in_context(fn) no submit.
+# Em pools de processos as etapas do processo filho não são registradas.
+
+log = logging.getLogger(__name__)
+
+REPORT_DIR = os.getenv("ETL_REPORT_DIR", "")
+
+_run = ContextVar("etl_run", default=None)
+_stages = ContextVar("etl_stages", default=())
+
+def peak_rss_kb():
+    """Pico de memória residente (KB) do processo e dos filhos já encerrados."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reporta em bytes
+
+class StageStats:
+    __slots__ = ("name", "seconds", "calls", "rows_in", "rows_out", "round_trips", "peak_rss_kb")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.round_trips = 0
+        self.peak_rss_kb = None
+
+    def as_dict(self):
+        rows = self.rows_out or self.rows_in
+        return {
+            "stage": self.name,
+            "seconds": round(self.seconds, 3),
+            "calls": self.calls,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_s": round(rows / self.seconds, 1) if self.seconds else None,
+            "round_trips": self.round_trips,
+            "peak_rss_kb": self.peak_rss_kb,
+        }
+
+class Run:
+    """Métricas de uma execução. Thread-safe: etapas podem ser alimentadas por vários workers."""
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.status = "running"
+        self.error = None
+        self.seconds = None
+        self.round_trips = 0
+        self.stages = {}
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+        return stats
+
+    def add(self, stage_names, rows_in=0, rows_out=0, round_trips=0):
+        with self._lock:
+            self.round_trips += round_trips
+            for name in stage_names:
+                stats = self._stage(name)
+                stats.rows_in += rows_in
+                stats.rows_out += rows_out
+                stats.round_trips += round_trips
+
+    def close_stage(self, name, seconds):
+        rss = peak_rss_kb()
+        with self._lock:
+            stats = self._stage(name)
+            stats.seconds += seconds
+            stats.calls += 1
+            if rss is not None:
+                stats.peak_rss_kb = max(stats.peak_rss_kb or 0, rss)
+
+    def finish(self, status, error=None):
+        self.seconds = time.perf_counter() - self._t0
+        self.finished_at = datetime.now(timezone.utc)
+        self.status = status
+        self.error = error
+
+    def report(self):
+        with self._lock:
+            stages = [s.as_dict() for s in self.stages.values()]
+        top = [s for s in stages if "." not in s["stage"]]
+        return {
+            "run": self.name,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "status": self.status,
+            "error": self.error,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "rows_in": sum(s["rows_in"] for s in top),
+            "rows_out": sum(s["rows_out"] for s in top),
+            "round_trips": self.round_trips,
+            "peak_rss_kb": peak_rss_kb(),
+            "stages": stages,
+        }
+
+@contextmanager
+def run(name):
+    """Mede uma execução inteira; ao sair (com sucesso ou erro) registra o histórico."""
+    r = Run(name)
+    run_token, stages_token = _run.set(r), _stages.set(())
+    try:
+        yield r
+        r.finish("success")
+    except BaseException as exc:
+        r.finish("failed", repr(exc))
+        raise
+    finally:
+        _run.reset(run_token)
+        _stages.reset(stages_token)
+        record_run(r)
+
+@contextmanager
+def stage(name):
+    r = _run.get()
+    if r is None:  # fora de uma execução instrumentada (p.ex. loader chamado isoladamente)
+        yield
+        return
+    path = _stages.get()
+    full = f"{path[-1]}.{name}" if path else name
+    token = _stages.set(path + (full,))
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages.reset(token)
+        r.close_stage(full, time.perf_counter() - t0)
+
+def count_rows(rows_in=0, rows_out=0):
+    r = _run.get()
+    if r is not None:
+        r.add(_stages.get(), rows_in=rows_in, rows_out=rows_out)
+
+def count_round_trip(n=1):
+    r = _run.get()
+    if r is not None:
+        r.add(_stages.get(), round_trips=n)
+
+def in_context(fn):
+    """Envolve fn para rodar (em outra thread) com a execução e as etapas do contexto atual."""
+    ctx = copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+def record_run(r):
+    """Emite o relatório JSON e grava a execução em dw.etl_run_history (falhas aqui só geram aviso)."""
+    report = r.report()
+    payload = json.dumps(report, default=str)
+    log.info("execução %s: %s", r.name, payload)
+    if REPORT_DIR:
+        try:
+            os.makedirs(REPORT_DIR, exist_ok=True)
+            path = os.path.join(REPORT_DIR, f"{r.name}_{r.started_at:%Y%m%dT%H%M%S}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, default=str)
+        except OSError as exc:
+            log.warning("não foi possível gravar o relatório da execução %s: %r", r.name, exc)
+    from .db import dw_conn, execute  # import tardio: db importa este módulo
+    try:
+        with dw_conn() as dw:
+            execute(dw, """
+              INSERT INTO dw.etl_run_history(
+                run_name, started_at, finished_at, status, error, seconds,
+                rows_in, rows_out, round_trips, peak_rss_kb, report)
+              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb)
+            """, (r.name, r.started_at, r.finished_at, r.status, r.error, report["seconds"],
+                  report["rows_in"], report["rows_out"], report["round_trips"], report["peak_rss_kb"], payload))
+    except Exception as exc:
+        log.warning("não foi possível gravar a execução %s em dw.etl_run_history: %r", r.name, exc)
@@ -0,0 +1,103 @@
+import asyncio
+import os
+from contextlib import contextmanager, suppress
+from .db import dw_conn, dw_conns
+
+# Modo concorrente das cargas de fatos: extract, transform e load rodam ao mesmo tempo, ligados por
+# filas limitadas (asyncio.Queue). psycopg2 é bloqueante, então cada etapa chama o driver via
+# asyncio.to_thread, com a sua própria conexão. Enquanto o DW grava o lote n, o transform resolve as
+# chaves do lote n+1 e o OLTP já busca o lote n+2; com filas de QUEUE_SIZE lotes, a etapa mais rápida
+# espera a mais lenta (backpressure) em vez de acumular lotes em memória. O tempo total tende ao da
+# etapa mais lenta, e não à soma das etapas.
+# - ETL_OVERLAP=1 liga o modo por padrão (os loaders também aceitam overlap=True/False).
+# - ETL_OVERLAP_QUEUE: lotes por fila (default 4).
+
+ENABLED = os.getenv("ETL_OVERLAP", "0") == "1"
+QUEUE_SIZE = int(os.getenv("ETL_OVERLAP_QUEUE", "4"))
+
+_END = object()
+_ABORT = object()
+
+class PipelineAborted(Exception):
+    """O extract ou o transform falhou: levantada dentro do load para desfazer a unidade de trabalho em curso."""
+
+def enabled(overlap=None):
+    return ENABLED if overlap is None else overlap
+
+@contextmanager
+def dw_connections(overlap=None):
+    """
+    (conexão do load, conexão do transform para os lookups do KeyResolver): a mesma conexão em
+    sequência; no modo concorrente, duas conexões do pool, reservadas juntas (dw_conns), para as
+    consultas de chaves não esperarem pelo COPY do load. Reservar uma e depois pedir a outra travaria
+    com workers x 2 > ETL_POOL_MAX: cada worker com uma conexão, todos esperando a segunda.
+    """
+    if not enabled(overlap):
+        with dw_conn() as dw:
+            yield dw, dw
+        return
+    with dw_conns(2) as (dw, keys_dw):
+        yield dw, keys_dw
+
+def run(batches, transform, load, overlap=None, queue_size=None):
+    """
+    Chama load com os pares (lote, transform(lote)), na ordem de batches, e devolve o seu resultado.
+    Com overlap, iterar batches (extract), transform e load rodam concorrentemente; senão, em sequência
+    na thread atual. Uma falha em qualquer etapa interrompe as demais e é relançada aqui.
+    """
+    if not enabled(overlap):
+        return load((batch, transform(batch)) for batch in batches)
+    return asyncio.run(_pipeline(iter(batches), transform, load, queue_size or QUEUE_SIZE))
+
+async def _pipeline(batches, transform, load, size):
+    loop = asyncio.get_running_loop()
+    extracted, transformed = asyncio.Queue(size), asyncio.Queue(size)
+
+    async def extract():
+        while True:
+            batch = await asyncio.to_thread(next, batches, _END)
+            await extracted.put(batch)
+            if batch is _END:
+                return
+
+    async def transform_all():
+        while True:
+            batch = await extracted.get()
+            if batch is _END:
+                await transformed.put(_END)
+                return
+            await transformed.put((batch, await asyncio.to_thread(transform, batch)))
+
+    def items():
+        # roda na thread do load: cada item é retirado da fila no loop de eventos
+        while True:
+            item = asyncio.run_coroutine_threadsafe(transformed.get(), loop).result()
+            if item is _END:
+                return
+            if item is _ABORT:
+                raise PipelineAborted()
+            yield item
+
+    producers = [asyncio.create_task(extract()), asyncio.create_task(transform_all())]
+    loader = asyncio.create_task(asyncio.to_thread(load, items()))
+    await asyncio.wait([*producers, loader], return_when=asyncio.FIRST_EXCEPTION)
+
+    failed = next((t for t in producers if t.done() and t.exception() is not None), None)
+    if failed is not None:
+        # o load pode estar esperando um lote: esvazia a fila e o avisa para abortar
+        for t in producers:
+            t.cancel()
+        while not transformed.empty():
+            transformed.get_nowait()
+        transformed.put_nowait(_ABORT)
+        with suppress(Exception):
+            await loader
+        raise failed.exception()
+    if loader.done() and loader.exception() is not None:
+        # extract/transform podem estar bloqueados em uma fila cheia
+        for t in producers:
+            t.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+        raise loader.exception()
+    await asyncio.gather(*producers)
+    return await loader
@@ -0,0 +1,103 @@
+import re
+import threading
+from datetime import date
+from typing import Iterable, List, Set
+from .db import fetch_one, fetch_all
+
+# Partições mensais de dw.fact_sales (ver sql/04_fact_sales_partitions.sql).
+# - ensure_fact_sales_partitions cria sob demanda as partições dos meses recebidos, na transação do chamador.
+#   O cache por processo só recebe um mês por remember_partitions, após o commit dessa transação: se ela
+#   for desfeita, a partição some junto e a próxima carga a cria de novo.
+# - swap_fact_sales_partition troca o conteúdo de um mês inteiro por uma tabela já carregada
+#   (DETACH + DROP + ATTACH), em vez de DELETE.
+
+_known: Set[int] = set()
+_known_lock = threading.Lock()
+
+def month_of(date_key: int) -> int:
+    """yyyymmdd -> yyyymm"""
+    return date_key // 100
+
+def month_bounds(yyyymm: int):
+    """Faixa [início, fim) em order_date_key do mês."""
+    year, month = divmod(yyyymm, 100)
+    nxt = (year + 1) * 100 + 1 if month == 12 else yyyymm + 1
+    return yyyymm * 100 + 1, nxt * 100 + 1
+
+def month_dates(yyyymm: int):
+    """Faixa [início, fim) em datas do mês."""
+    start, end = month_bounds(yyyymm)
+    return (date(start // 10000, start // 100 % 100, 1), date(end // 10000, end // 100 % 100, 1))
+
+def partition_name(yyyymm: int) -> str:
+    return f"dw.fact_sales_p{yyyymm}"
+
+def ensure_fact_sales_partitions(dw_conn, months: Iterable[int]) -> List[int]:
+    """
+    Garante a partição de cada mês (yyyymm) fora do cache. Não faz commit: a criação entra na transação
+    corrente. Retorna os meses verificados, para remember_partitions após o commit.
+    """
+    with _known_lock:
+        missing = sorted(set(months) - _known)
+    for yyyymm in missing:
+        fetch_one(dw_conn, "SELECT dw.ensure_fact_sales_partition(%s) AS name", (month_dates(yyyymm)[0],))
+    return missing
+
+def remember_partitions(months: Iterable[int]) -> None:
+    """Registra no cache meses cuja partição já está confirmada (chamar depois do commit)."""
+    with _known_lock:
+        _known.update(months)
+
+def prepare_partition_stage(dw_conn, yyyymm: int) -> str:
+    """
+    Cria uma tabela vazia com a estrutura, o CHECK de faixa e os índices da partição do mês,
+    pronta para receber a carga e depois ser anexada por swap_fact_sales_partition.
+    """
+    start, end = month_bounds(yyyymm)
+    stage = partition_name(yyyymm) + "_new"
+    with dw_conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {stage}")
+        cur.execute(f"CREATE TABLE {stage} (LIKE dw.fact_sales INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        # CHECK equivalente à faixa: o ATTACH não precisa varrer a tabela
+        cur.execute(f"ALTER TABLE {stage} ADD CONSTRAINT {stage.split('.')[1]}_range "
+                    f"CHECK (order_date_key >= {start} AND order_date_key < {end})")
+    dw_conn.commit()
+    return stage
+
+def _index_statements(dw_conn, stage: str):
+    # replica na tabela de staging os índices de dw.fact_sales (o ATTACH reaproveita índices equivalentes)
+    rows = fetch_all(dw_conn, """
+        SELECT pg_get_indexdef(i.indexrelid) AS def, i.indisprimary AS is_pk
+          FROM pg_index i
+         WHERE i.indrelid = 'dw.fact_sales'::regclass
+    """)
+    stmts = []
+    for r in rows:
+        body = re.sub(r"^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+ ", "", r["def"])
+        if r["is_pk"]:
+            cols = re.search(r"\((.*)\)", body).group(1)
+            stmts.append(f"ALTER TABLE {stage} ADD PRIMARY KEY ({cols})")
+        else:
+            unique = "UNIQUE " if r["def"].startswith("CREATE UNIQUE") else ""
+            stmts.append(f"CREATE {unique}INDEX ON {stage} {body}")
+    return stmts
+
+def swap_fact_sales_partition(dw_conn, yyyymm: int, stage: str) -> None:
+    """Indexa a staging e a coloca no lugar da partição do mês em uma única transação."""
+    start, end = month_bounds(yyyymm)
+    part = partition_name(yyyymm)
+    with dw_conn.cursor() as cur:
+        for stmt in _index_statements(dw_conn, stage):
+            cur.execute(stmt)
+        cur.execute(f"ANALYZE {stage}")
+    dw_conn.commit()
+
+    with dw_conn.cursor() as cur:
+        if fetch_one(dw_conn, "SELECT to_regclass(%s) AS t", (part,))["t"]:
+            cur.execute(f"ALTER TABLE dw.fact_sales DETACH PARTITION {part}")
+            cur.execute(f"DROP TABLE {part}")
+        cur.execute(f"ALTER TABLE {stage} RENAME TO {part.split('.')[1]}")
+        cur.execute(f"ALTER TABLE dw.fact_sales ATTACH PARTITION {part} FOR VALUES FROM ({start}) TO ({end})")
+    dw_conn.commit()
+    with _known_lock:
+        _known.add(yyyymm)
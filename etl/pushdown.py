@@ -0,0 +1,79 @@
+import os
+from .db import fetch_one, fetch_all
+from .metrics import stage
+from .scd import SCD1Spec, scd1_upsert_sql
+
+# Modo pushdown (ELT no banco) para OLTP e DW alcançáveis um pelo outro (mesmo cluster ou rede).
+# Em vez de trazer as linhas para o Python, o DW lê o OLTP via dblink e faz extração, lookup de
+# chaves e gravação em INSERT ... SELECT, com as mesmas regras do caminho em Python.
+# Requer no DW a extensão dblink e um servidor do OLTP (dblink_fdw) com user mapping (sql/05_pushdown.sql):
+# as consultas citam só o nome do servidor, e as credenciais ficam no catálogo, fora do texto SQL
+# (pg_stat_activity, log_statement e mensagens de erro).
+# - ETL_PUSHDOWN=1 liga o modo por padrão (os loaders também aceitam pushdown=True/False).
+# - ETL_PUSHDOWN_SERVER: nome do servidor do OLTP no DW (default oltp_pushdown).
+
+ENABLED = os.getenv("ETL_PUSHDOWN", "0") == "1"
+SERVER = os.getenv("ETL_PUSHDOWN_SERVER", "oltp_pushdown")
+
+def enabled(pushdown=None):
+    return ENABLED if pushdown is None else pushdown
+
+def remote_source(dw_conn, sql, params, columns, alias="r"):
+    """
+    Fragmento de FROM que executa sql (com params) no OLTP: dblink(...) AS alias(coluna tipo, ...).
+    columns = [(coluna, tipo)]; as colunas são selecionadas por nome, na ordem de columns.
+    """
+    names = ", ".join(f'"{c}"' for c, _ in columns)
+    defs = ", ".join(f'"{c}" {t}' for c, t in columns)
+    check_server(dw_conn)
+    with dw_conn.cursor() as cur:
+        query = cur.mogrify(sql, params).decode() if params else sql
+        remote = cur.mogrify("dblink(%s, %s)", (SERVER, f"SELECT {names} FROM ({query}) q")).decode()
+    return f"{remote} AS {alias}({defs})"
+
+def check_server(dw_conn):
+    """
+    Confere o servidor do OLTP e o user mapping do usuário corrente: sem eles o dblink trataria o nome
+    como string de conexão e falharia com uma mensagem sem relação com a causa.
+    """
+    r = fetch_one(dw_conn, """
+        SELECT EXISTS (SELECT 1 FROM pg_foreign_server WHERE srvname = %(s)s) AS server,
+               EXISTS (SELECT 1 FROM pg_user_mappings
+                        WHERE srvname = %(s)s AND usename IN (current_user, 'public')) AS mapping
+    """, {"s": SERVER})
+    if not (r["server"] and r["mapping"]):
+        raise RuntimeError(f"pushdown: servidor {SERVER!r} ou user mapping ausente no DW (ver sql/05_pushdown.sql)")
+
+def table_columns(dw_conn, table, columns):
+    """[(coluna, tipo)] de columns conforme declaradas em table no DW."""
+    rows = fetch_all(dw_conn, """
+        SELECT attname, format_type(atttypid, atttypmod) AS type
+          FROM pg_attribute
+         WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+    """, (table,))
+    types = {r["attname"]: r["type"] for r in rows}
+    return [(c, types[c]) for c in columns]
+
+def upsert_scd1(dw_conn, spec: SCD1Spec, extract_sql: str, params=None):
+    """
+    Upsert da dimensão SCD1 em um único comando sobre o OLTP remoto. extract_sql devolve spec.nk,
+    spec.columns, row_hash e modifieddate (ver scd.changed_since). Retorna o maior modifieddate lido.
+    """
+    columns = table_columns(dw_conn, spec.table, [spec.nk, *spec.columns, "row_hash"]) + [("modifieddate", "timestamp")]
+    source = remote_source(dw_conn, extract_sql, params, columns)
+    with stage("pushdown"), dw_conn.cursor() as cur:
+        # src é lido uma vez (CTE referenciada duas vezes é materializada): upsert + watermark
+        cur.execute(f"""
+            WITH src AS (SELECT * FROM {source}),
+                 up AS ({scd1_upsert_sql(spec, "src")})
+            SELECT max(modifieddate) AS m FROM src
+        """)
+        max_modified = cur.fetchone()["m"]
+    dw_conn.commit()
+    return max_modified
+
+def run(dw_conn, sql):
+    """Executa sql já montado (sem parâmetros: o texto remoto embutido pode conter %); não faz commit."""
+    with dw_conn.cursor() as cur:
+        cur.execute(sql)
+        return cur.rowcount
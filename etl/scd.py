@@ -1,124 +1,123 @@
 from datetime import date
-from typing import Dict, Any, Tuple
-from .db import fetch_one, execute
+from typing import Dict, Any, Iterable, NamedTuple, Tuple
+from .db import fetch_all, copy_rows
+from .metrics import stage
 
-# Funções utilitárias SCD2 para produto e cliente (simples e performático o suficiente para cargas de exemplo).
+# Merge SCD2 set-based, genérico por dimensão.
 # Estratégia:
-# - Checa linha atual (is_current = true) por natural key.
-# - Se não existe, insere nova (valid_from = hoje).
-# - Se existe e mudou conteúdo relevante, encerra linha atual (valid_to = ontem, is_current = false) e insere nova.
+# - Carrega o lote recebido (via COPY) em uma tabela temporária de staging, uma linha por natural key.
+# - Compara um hash (md5) das colunas rastreadas do staging com o da linha atual (is_current = true),
+#   guardado em row_hash na versão inserida (linhas anteriores sem row_hash: calculado na hora).
+# - Encerra as versões alteradas (valid_to = valid_from do lote, is_current = false) em um único UPDATE.
+# - Insere as versões novas/alteradas em um único INSERT ... SELECT.
+# - Retorna o mapa natural key -> surrogate key corrente.
 
-def _different(a: Any, b: Any) -> bool:
-    return (a or None) != (b or None)
+class SCD2Spec(NamedTuple):
+    table: str
+    key: str
+    nk: str
+    columns: Tuple[str, ...]  # colunas rastreadas (mudança gera nova versão)
 
-def upsert_scd2_product(dw_conn, row: Dict[str, Any]) -> int:
-    """
-    row esperada:
-      product_nk, product_name, product_number, color, size, style, subcategory, category,
-      standard_cost, list_price, valid_from (date)
-    Retorna product_key.
-    """
-    current = fetch_one(dw_conn, """
-        SELECT * FROM dw.dim_product
-        WHERE product_nk = %s AND is_current = true
-    """, (row["product_nk"],))
-    today = row.get("valid_from") or date.today()
+PRODUCT_SCD2 = SCD2Spec(
+    table="dw.dim_product",
+    key="product_key",
+    nk="product_nk",
+    columns=("product_name", "product_number", "color", "size", "style", "subcategory", "category",
+             "standard_cost", "list_price"),
+)
 
-    if not current:
-        # insert new current
-        execute(dw_conn, """
-            INSERT INTO dw.dim_product
-              (product_nk, product_name, product_number, color, size, style, subcategory, category,
-               standard_cost, list_price, valid_from, valid_to, is_current)
-            VALUES
-              (%(product_nk)s, %(product_name)s, %(product_number)s, %(color)s, %(size)s, %(style)s, %(subcategory)s, %(category)s,
-               %(standard_cost)s, %(list_price)s, %(valid_from)s, NULL, true)
-        """, row)
-        new_key = fetch_one(dw_conn, "SELECT currval(pg_get_serial_sequence('dw.dim_product','product_key')) AS id")["id"]
-        return new_key
+CUSTOMER_SCD2 = SCD2Spec(
+    table="dw.dim_customer",
+    key="customer_key",
+    nk="customer_nk",
+    columns=("customer_type", "person_nk", "store_nk", "customer_name", "email_address", "phone", "territory_nk"),
+)
 
-    changed = any([
-        _different(current["product_name"], row["product_name"]),
-        _different(current["product_number"], row["product_number"]),
-        _different(current["color"], row["color"]),
-        _different(current["size"], row["size"]),
-        _different(current["style"], row["style"]),
-        _different(current["subcategory"], row["subcategory"]),
-        _different(current["category"], row["category"]),
-        _different(str(current["standard_cost"]), str(row["standard_cost"])),
-        _different(str(current["list_price"]), str(row["list_price"])),
-    ])
-    if not changed:
-        return current["product_key"]
+class SCD1Spec(NamedTuple):
+    table: str
+    nk: str
+    columns: Tuple[str, ...]  # colunas sobrescritas a cada carga (sem histórico)
 
-    # close current
-    execute(dw_conn, """
-        UPDATE dw.dim_product
-           SET valid_to = %(yesterday)s, is_current = false
-         WHERE product_key = %(product_key)s
-    """, {"yesterday": today, "product_key": current["product_key"]})
+def changed_since(extract_sql: str, columns: Iterable[str] = None) -> str:
+    """
+    Restringe extract_sql (que expõe modifieddate) às linhas com modifieddate >= %(since)s
+    (since None: todas). Com columns, acrescenta row_hash = md5 dessas colunas, calculado no OLTP.
+    """
+    row_hash = f", {_row_hash('q', columns)} AS row_hash" if columns else ""
+    # >= : linhas com o mesmo timestamp do watermark são relidas; o row_hash/merge as descarta
+    return f"""
+        SELECT q.*{row_hash}
+          FROM ({extract_sql}) q
+         WHERE (%(since)s IS NULL OR q.modifieddate >= %(since)s)
+    """
 
-    # insert new
-    execute(dw_conn, """
-        INSERT INTO dw.dim_product
-          (product_nk, product_name, product_number, color, size, style, subcategory, category,
-           standard_cost, list_price, valid_from, valid_to, is_current)
-        VALUES
-          (%(product_nk)s, %(product_name)s, %(product_number)s, %(color)s, %(size)s, %(style)s, %(subcategory)s, %(category)s,
-           %(standard_cost)s, %(list_price)s, %(valid_from)s, NULL, true)
-    """, row)
-    new_key = fetch_one(dw_conn, "SELECT currval(pg_get_serial_sequence('dw.dim_product','product_key')) AS id")["id"]
-    return new_key
+def scd1_upsert_sql(spec: SCD1Spec, source: str = None) -> str:
+    """
+    INSERT ... ON CONFLICT (nk) DO UPDATE da dimensão, incluindo row_hash. source=None: VALUES com
+    parâmetros nomeados (executemany com as linhas extraídas); senão INSERT ... SELECT das colunas de source.
+    Linhas existentes com o mesmo row_hash não são regravadas.
+    """
+    cols = [spec.nk, *spec.columns, "row_hash"]
+    col_list = ", ".join(f'"{c}"' for c in cols)
+    if source is None:
+        values = "VALUES (" + ", ".join(f"%({c})s" for c in cols) + ")"
+    else:
+        values = f"SELECT {col_list} FROM {source}"
+    updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in [*spec.columns, "row_hash"])
+    return (f"INSERT INTO {spec.table} AS t ({col_list}) {values} ON CONFLICT ({spec.nk}) DO UPDATE SET {updates}"
+            f" WHERE t.row_hash IS DISTINCT FROM EXCLUDED.row_hash")
 
-def upsert_scd2_customer(dw_conn, row: Dict[str, Any]) -> int:
+def _row_hash(alias: str, columns: Iterable[str]) -> str:
+    return "md5(ROW(" + ", ".join(f'{alias}."{c}"' for c in columns) + ")::text)"
+
+def merge_scd2(dw_conn, spec: SCD2Spec, rows: Iterable[Dict[str, Any]], valid_from: date = None) -> Dict[Any, int]:
     """
-    row esperada:
-      customer_nk, customer_type, person_nk, store_nk, customer_name, email_address, phone, territory_nk, valid_from
-    Retorna customer_key.
+    rows: dicts com spec.nk + spec.columns (chaves extras são ignoradas).
+    Retorna {natural key: surrogate key corrente} para as NKs do lote.
     """
-    current = fetch_one(dw_conn, """
-        SELECT * FROM dw.dim_customer
-        WHERE customer_nk = %s AND is_current = true
-    """, (row["customer_nk"],))
-    today = row.get("valid_from") or date.today()
+    valid_from = valid_from or date.today()
+    stg = "_scd2_" + spec.table.replace(".", "_")
+    cols = [spec.nk, *spec.columns]
+    col_list = ", ".join(cols)
+    params = {"valid_from": valid_from}
+
+    with dw_conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {stg}")
+        cur.execute(f"CREATE TEMP TABLE {stg} AS SELECT {col_list} FROM {spec.table} WITH NO DATA")
+    copy_rows(dw_conn, stg, cols, rows, commit=False)
 
-    if not current:
-        execute(dw_conn, """
-            INSERT INTO dw.dim_customer
-              (customer_nk, customer_type, person_nk, store_nk, customer_name, email_address, phone, territory_nk,
-               valid_from, valid_to, is_current)
-            VALUES
-              (%(customer_nk)s, %(customer_type)s, %(person_nk)s, %(store_nk)s, %(customer_name)s, %(email_address)s, %(phone)s, %(territory_nk)s,
-               %(valid_from)s, NULL, true)
-        """, row)
-        new_key = fetch_one(dw_conn, "SELECT currval(pg_get_serial_sequence('dw.dim_customer','customer_key')) AS id")["id"]
-        return new_key
+    with stage("merge"), dw_conn.cursor() as cur:
+        # uma linha por NK (a última recebida prevalece)
+        cur.execute(f"DELETE FROM {stg} a USING {stg} b WHERE a.{spec.nk} = b.{spec.nk} AND a.ctid < b.ctid")
+        cur.execute(f"ANALYZE {stg}")
 
-    changed = any([
-        _different(current["customer_type"], row["customer_type"]),
-        _different(current["person_nk"], row["person_nk"]),
-        _different(current["store_nk"], row["store_nk"]),
-        _different(current["customer_name"], row["customer_name"]),
-        _different(current["email_address"], row["email_address"]),
-        _different(current["phone"], row["phone"]),
-        _different(current["territory_nk"], row["territory_nk"]),
-    ])
-    if not changed:
-        return current["customer_key"]
+        # encerra versões correntes cujo conteúdo mudou
+        cur.execute(f"""
+            UPDATE {spec.table} t
+               SET valid_to = %(valid_from)s, is_current = false
+              FROM {stg} s
+             WHERE t.{spec.nk} = s.{spec.nk}
+               AND t.is_current
+               AND COALESCE(t.row_hash, {_row_hash("t", spec.columns)}) <> {_row_hash("s", spec.columns)}
+        """, params)
 
-    execute(dw_conn, """
-        UPDATE dw.dim_customer
-           SET valid_to = %(yesterday)s, is_current = false
-         WHERE customer_key = %(customer_key)s
-    """, {"yesterday": today, "customer_key": current["customer_key"]})
+        # insere NKs novas e as que acabaram de ser encerradas
+        cur.execute(f"""
+            INSERT INTO {spec.table} ({col_list}, row_hash, valid_from, valid_to, is_current)
+            SELECT {", ".join("s." + c for c in cols)}, {_row_hash("s", spec.columns)}, %(valid_from)s, NULL, true
+              FROM {stg} s
+             WHERE NOT EXISTS (
+                   SELECT 1 FROM {spec.table} t
+                    WHERE t.{spec.nk} = s.{spec.nk} AND t.is_current)
+        """, params)
 
-    execute(dw_conn, """
-        INSERT INTO dw.dim_customer
-          (customer_nk, customer_type, person_nk, store_nk, customer_name, email_address, phone, territory_nk,
-           valid_from, valid_to, is_current)
-        VALUES
-          (%(customer_nk)s, %(customer_type)s, %(person_nk)s, %(store_nk)s, %(customer_name)s, %(email_address)s, %(phone)s, %(territory_nk)s,
-           %(valid_from)s, NULL, true)
-    """, row)
-    new_key = fetch_one(dw_conn, "SELECT currval(pg_get_serial_sequence('dw.dim_customer','customer_key')) AS id")["id"]
-    return new_key
\ No newline at end of file
+    keys = fetch_all(dw_conn, f"""
+        SELECT t.{spec.nk} AS nk, t.{spec.key} AS id
+          FROM {spec.table} t
+          JOIN {stg} s ON s.{spec.nk} = t.{spec.nk}
+         WHERE t.is_current
+    """)
+    with dw_conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {stg}")
+    dw_conn.commit()
+    return {r["nk"]: r["id"] for r in keys}
@@ -9,4 +9,49 @@ CREATE TABLE IF NOT EXISTS dw.etl_run_control (
 );
 
 -- Índice útil para consultas de controle
-CREATE INDEX IF NOT EXISTS ix_etl_run_control_updated_at ON dw.etl_run_control(updated_at);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS ix_etl_run_control_updated_at ON dw.etl_run_control(updated_at);
+-- Histórico de execuções do ETL (uma linha por execução; report = relatório JSON com as etapas)
+CREATE TABLE IF NOT EXISTS dw.etl_run_history (
+  run_id bigserial PRIMARY KEY,
+  run_name text NOT NULL,
+  started_at timestamptz NOT NULL,
+  finished_at timestamptz,
+  status text NOT NULL,
+  error text,
+  seconds numeric(12,3),
+  rows_in bigint,
+  rows_out bigint,
+  round_trips bigint,
+  peak_rss_kb bigint,
+  report jsonb NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_etl_run_history_name_started ON dw.etl_run_history(run_name, started_at);
+
+-- Etapas de cada execução comparadas com a execução anterior de mesmo nome (regressões noite a noite)
+CREATE OR REPLACE VIEW dw.v_etl_stage_trend AS
+SELECT
+  h.run_id,
+  h.run_name,
+  h.started_at,
+  s.stage,
+  s.seconds,
+  s.rows_out,
+  s.round_trips,
+  s.seconds - lag(s.seconds) OVER w AS seconds_delta,
+  s.round_trips - lag(s.round_trips) OVER w AS round_trips_delta
+FROM dw.etl_run_history h
+CROSS JOIN LATERAL jsonb_to_recordset(h.report -> 'stages')
+  AS s(stage text, seconds numeric, rows_out bigint, round_trips bigint)
+WHERE h.status = 'success'
+WINDOW w AS (PARTITION BY h.run_name, s.stage ORDER BY h.started_at);
+
+-- Índices/FKs removidos pelo modo de carga em massa (etl/bulk_load.py) e ainda não recriados
+CREATE TABLE IF NOT EXISTS dw.etl_bulk_load_ddl (
+  table_name text NOT NULL,
+  kind text NOT NULL,        -- 'index' ou 'fk'
+  name text NOT NULL,
+  definition text NOT NULL,  -- pg_get_indexdef / pg_get_constraintdef
+  saved_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (table_name, name)
+);
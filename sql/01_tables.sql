@@ -26,11 +26,14 @@ CREATE TABLE IF NOT EXISTS dw.dim_product (
   category text,
   standard_cost numeric(18,4),
   list_price numeric(18,4),
+  row_hash text, -- md5 das colunas rastreadas da versão
   valid_from date NOT NULL,
   valid_to date,
   is_current boolean NOT NULL DEFAULT true
 );
 CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_product_current ON dw.dim_product(product_nk) WHERE is_current;
+-- versões por NK (lookup da versão vigente numa data: AsOfIndex / lookup_sql as_of)
+CREATE INDEX IF NOT EXISTS ix_dim_product_nk_valid_from ON dw.dim_product(product_nk, valid_from);
 
 -- dim_customer (SCD2)
 CREATE TABLE IF NOT EXISTS dw.dim_customer (
@@ -43,11 +46,13 @@ CREATE TABLE IF NOT EXISTS dw.dim_customer (
   email_address text,
   phone text,
   territory_nk int,
+  row_hash text,
   valid_from date NOT NULL,
   valid_to date,
   is_current boolean NOT NULL DEFAULT true
 );
 CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_customer_current ON dw.dim_customer(customer_nk) WHERE is_current;
+CREATE INDEX IF NOT EXISTS ix_dim_customer_nk_valid_from ON dw.dim_customer(customer_nk, valid_from);
 
 -- dim_territory (SCD1)
 CREATE TABLE IF NOT EXISTS dw.dim_territory (
@@ -55,28 +60,32 @@ CREATE TABLE IF NOT EXISTS dw.dim_territory (
   territory_nk int NOT NULL UNIQUE,
   name text,
   country_region_code text,
-  "group" text
+  "group" text,
+  row_hash text -- md5 das colunas (calculado no OLTP): linha igual não é regravada
 );
 
 -- dim_employee (SCD1 - vendedor)
 CREATE TABLE IF NOT EXISTS dw.dim_employee (
   employee_key bigserial PRIMARY KEY,
   employee_nk int NOT NULL UNIQUE, -- HumanResources.Employee.BusinessEntityID
-  employee_name text
+  employee_name text,
+  row_hash text
 );
 
 -- dim_store (SCD1)
 CREATE TABLE IF NOT EXISTS dw.dim_store (
   store_key bigserial PRIMARY KEY,
   store_nk int NOT NULL UNIQUE, -- Sales.Store.BusinessEntityID
-  store_name text
+  store_name text,
+  row_hash text
 );
 
 -- dim_shipmethod (SCD1)
 CREATE TABLE IF NOT EXISTS dw.dim_shipmethod (
   ship_method_key bigserial PRIMARY KEY,
   ship_method_nk int NOT NULL UNIQUE, -- Purchasing.ShipMethod.ShipMethodID
-  name text
+  name text,
+  row_hash text
 );
 
 -- dim_promotion (SCD1) -> Sales.SpecialOffer
@@ -86,35 +95,52 @@ CREATE TABLE IF NOT EXISTS dw.dim_promotion (
   description text,
   discount_pct numeric(9,6),
   "type" text,
-  category text
+  category text,
+  row_hash text
 );
 
 -- dim_vendor (SCD1)
 CREATE TABLE IF NOT EXISTS dw.dim_vendor (
   vendor_key bigserial PRIMARY KEY,
   vendor_nk int NOT NULL UNIQUE, -- Purchasing.Vendor.BusinessEntityID
-  vendor_name text
+  vendor_name text,
+  row_hash text
 );
 
 -- dim_creditcard (SCD1)
 CREATE TABLE IF NOT EXISTS dw.dim_creditcard (
   credit_card_key bigserial PRIMARY KEY,
   credit_card_nk int NOT NULL UNIQUE, -- CreditCardID
-  card_type text
+  card_type text,
+  row_hash text
 );
 
 -- dim_location (SCD1) -> Production.Location
 CREATE TABLE IF NOT EXISTS dw.dim_location (
   location_key bigserial PRIMARY KEY,
   location_nk int NOT NULL UNIQUE, -- LocationID
-  location_name text
+  location_name text,
+  row_hash text
 );
 
+-- row_hash em DWs criados antes da detecção de mudanças (linhas sem hash são regravadas uma vez)
+ALTER TABLE dw.dim_product ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_customer ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_territory ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_employee ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_store ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_shipmethod ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_promotion ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_vendor ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_creditcard ADD COLUMN IF NOT EXISTS row_hash text;
+ALTER TABLE dw.dim_location ADD COLUMN IF NOT EXISTS row_hash text;
+
 -- Fatos
 
--- fact_sales
+-- fact_sales (particionada por faixa de order_date_key, uma partição por mês;
+-- partições criadas sob demanda por dw.ensure_fact_sales_partition - ver 04_fact_sales_partitions.sql)
 CREATE TABLE IF NOT EXISTS dw.fact_sales (
-  fact_sales_id bigserial PRIMARY KEY,
+  fact_sales_id bigserial,
   order_date_key int NOT NULL REFERENCES dw.dim_date(date_key),
   due_date_key int REFERENCES dw.dim_date(date_key),
   ship_date_key int REFERENCES dw.dim_date(date_key),
@@ -145,11 +171,14 @@ CREATE TABLE IF NOT EXISTS dw.fact_sales (
   shipping_days int,
   on_time_delivery boolean,
 
-  created_at timestamptz NOT NULL DEFAULT now()
-);
+  created_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (fact_sales_id, order_date_key)
+) PARTITION BY RANGE (order_date_key);
 CREATE INDEX IF NOT EXISTS ix_fact_sales_dates ON dw.fact_sales(order_date_key, ship_date_key);
 CREATE INDEX IF NOT EXISTS ix_fact_sales_product ON dw.fact_sales(product_key);
 CREATE INDEX IF NOT EXISTS ix_fact_sales_customer ON dw.fact_sales(customer_key);
+-- linhas gravadas desde a última exportação Parquet (fato só recebe INSERT: BRIN acompanha a ordem física)
+CREATE INDEX IF NOT EXISTS ix_fact_sales_created_at ON dw.fact_sales USING brin (created_at);
 
 -- fact_purchases
 CREATE TABLE IF NOT EXISTS dw.fact_purchases (
@@ -165,15 +194,96 @@ CREATE TABLE IF NOT EXISTS dw.fact_purchases (
   unit_price numeric(18,4) NOT NULL,
   line_total numeric(18,4) NOT NULL,
 
-  created_at timestamptz NOT NULL DEFAULT now()
+  created_at timestamptz NOT NULL DEFAULT now(),
+  updated_at timestamptz NOT NULL DEFAULT now() -- regravada pelo upsert incremental
 );
+ALTER TABLE dw.fact_purchases ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+-- Instalações existentes: o extract antigo (JOIN com productinventory só por productid) gravava uma
+-- linha por localização do produto. Antes do índice único fica uma linha por PurchaseOrderDetailID
+-- (a de maior ctid); as medidas das cópias eram idênticas.
+DO $$
+BEGIN
+  IF to_regclass('dw.ux_fact_purchases_line') IS NULL THEN
+    DELETE FROM dw.fact_purchases f
+     USING dw.fact_purchases g
+     WHERE g.purchase_order_line_id = f.purchase_order_line_id
+       AND g.ctid > f.ctid;
+  END IF;
+END;
+$$;
+-- chave de upsert da carga incremental (PurchaseOrderDetailID)
+CREATE UNIQUE INDEX IF NOT EXISTS ux_fact_purchases_line ON dw.fact_purchases(purchase_order_line_id);
+-- meses alterados desde a última exportação Parquet (etl.export_parquet)
+CREATE INDEX IF NOT EXISTS ix_fact_purchases_updated_at ON dw.fact_purchases(updated_at);
+-- consultas por data e por produto
+CREATE INDEX IF NOT EXISTS ix_fact_purchases_date ON dw.fact_purchases(order_date_key);
+CREATE INDEX IF NOT EXISTS ix_fact_purchases_product ON dw.fact_purchases(product_key);
 
 -- fact_inventory_snapshot (p.ex. mês a mês)
 CREATE TABLE IF NOT EXISTS dw.fact_inventory_snapshot (
   fact_inventory_snapshot_id bigserial PRIMARY KEY,
   snapshot_date_key int NOT NULL REFERENCES dw.dim_date(date_key),
-  product_key bigint REFERENCES dw.dim_product(product_key),
-  location_key bigint REFERENCES dw.dim_location(location_key),
+  product_key bigint NOT NULL REFERENCES dw.dim_product(product_key),
+  location_key bigint NOT NULL REFERENCES dw.dim_location(location_key),
   quantity_on_hand int NOT NULL,
   created_at timestamptz NOT NULL DEFAULT now()
-);
\ No newline at end of file
+);
+-- Instalações existentes: chaves nulas (produto/local não resolvido) escapariam do índice único e
+-- snapshots gravados em duplicidade impediriam a sua criação. Linhas sem chave não são atribuíveis e
+-- saem; das duplicadas fica a última gravada (maior ctid) de cada data/produto/local.
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM information_schema.columns
+              WHERE table_schema = 'dw' AND table_name = 'fact_inventory_snapshot'
+                AND column_name IN ('product_key', 'location_key') AND is_nullable = 'YES') THEN
+    DELETE FROM dw.fact_inventory_snapshot WHERE product_key IS NULL OR location_key IS NULL;
+    ALTER TABLE dw.fact_inventory_snapshot
+      ALTER COLUMN product_key SET NOT NULL,
+      ALTER COLUMN location_key SET NOT NULL;
+  END IF;
+  IF to_regclass('dw.ux_fact_inventory_snapshot') IS NULL THEN
+    DELETE FROM dw.fact_inventory_snapshot f
+     USING dw.fact_inventory_snapshot g
+     WHERE g.snapshot_date_key = f.snapshot_date_key
+       AND g.product_key = f.product_key
+       AND g.location_key = f.location_key
+       AND g.ctid > f.ctid;
+  END IF;
+END;
+$$;
+-- um registro por produto/local em cada data de snapshot
+CREATE UNIQUE INDEX IF NOT EXISTS ux_fact_inventory_snapshot ON dw.fact_inventory_snapshot(snapshot_date_key, product_key, location_key);
+-- consultas por produto (por data: o índice único acima, liderado por snapshot_date_key)
+CREATE INDEX IF NOT EXISTS ix_fact_inventory_snapshot_product ON dw.fact_inventory_snapshot(product_key);
+CREATE INDEX IF NOT EXISTS ix_fact_inventory_snapshot_created_at ON dw.fact_inventory_snapshot USING brin (created_at);
+
+-- Agregados
+
+-- agg_sales_month: medidas mensais de fact_sales, mantidas incrementalmente pelo ETL
+-- (somente os meses tocados em cada carga são recalculados). Base das views de KPI.
+-- Todos os componentes são aditivos; order_count também, pois todas as linhas de um pedido
+-- compartilham o mesmo order_date_key (o pedido pertence a um único mês).
+CREATE TABLE IF NOT EXISTS dw.agg_sales_month (
+  year int NOT NULL,
+  month int NOT NULL,
+  total_revenue numeric NOT NULL,
+  net_sales numeric NOT NULL,
+  gross_margin numeric NOT NULL,
+  units_sold bigint NOT NULL,
+  discount_weighted numeric NOT NULL,    -- SUM(unit_price_discount * line_subtotal)
+  shipping_days_sum bigint NOT NULL,
+  shipping_days_count bigint NOT NULL,   -- linhas com shipping_days não nulo
+  on_time_count bigint NOT NULL,
+  line_count bigint NOT NULL,
+  order_count bigint NOT NULL,           -- pedidos distintos (sales_order_number)
+  PRIMARY KEY (year, month)
+);
+
+-- agg_sales_month_territory: receita mensal por território
+CREATE TABLE IF NOT EXISTS dw.agg_sales_month_territory (
+  year int NOT NULL,
+  month int NOT NULL,
+  territory_key bigint,
+  revenue numeric NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_agg_sales_month_territory ON dw.agg_sales_month_territory(year, month);
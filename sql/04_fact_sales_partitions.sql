@@ -0,0 +1,63 @@
+-- Particionamento mensal de dw.fact_sales
+
+-- Cria (se necessário) a partição do mês de p_month e retorna o nome qualificado.
+-- Faixa: [yyyymm01, yyyymm01 do mês seguinte) em order_date_key.
+CREATE OR REPLACE FUNCTION dw.ensure_fact_sales_partition(p_month date)
+RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+  v_start date := date_trunc('month', p_month)::date;
+  v_end   date := (date_trunc('month', p_month) + interval '1 month')::date;
+  v_name  text := 'fact_sales_p' || to_char(v_start, 'YYYYMM');
+BEGIN
+  IF to_regclass('dw.' || v_name) IS NULL THEN
+    BEGIN
+      EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS dw.%I PARTITION OF dw.fact_sales FOR VALUES FROM (%s) TO (%s)',
+        v_name, to_char(v_start, 'YYYYMMDD'), to_char(v_end, 'YYYYMMDD'));
+    EXCEPTION WHEN duplicate_table OR unique_violation THEN
+      -- criada por uma transação concorrente depois da verificação acima (unique_violation: conflito
+      -- no catálogo quando a outra transação confirma enquanto esta espera)
+      NULL;
+    END;
+  END IF;
+  RETURN 'dw.' || v_name;
+END;
+$$;
+
+-- Migração: converte uma dw.fact_sales ainda não particionada (criada por versões anteriores de 01_tables.sql).
+DO $$
+DECLARE
+  c record;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('dw.fact_sales')) <> 'r' THEN
+    RETURN;
+  END IF;
+
+  ALTER TABLE dw.fact_sales RENAME TO fact_sales_heap;
+  ALTER TABLE dw.fact_sales_heap DROP CONSTRAINT fact_sales_pkey;
+  CREATE TABLE dw.fact_sales (LIKE dw.fact_sales_heap INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (order_date_key);
+  ALTER TABLE dw.fact_sales ADD PRIMARY KEY (fact_sales_id, order_date_key);
+  FOR c IN
+    SELECT conname, pg_get_constraintdef(oid) AS def
+      FROM pg_constraint
+     WHERE conrelid = 'dw.fact_sales_heap'::regclass AND contype = 'f'
+  LOOP
+    EXECUTE format('ALTER TABLE dw.fact_sales_heap DROP CONSTRAINT %I', c.conname);
+    EXECUTE format('ALTER TABLE dw.fact_sales ADD CONSTRAINT %I %s', c.conname, c.def);
+  END LOOP;
+  ALTER SEQUENCE dw.fact_sales_fact_sales_id_seq OWNED BY dw.fact_sales.fact_sales_id;
+
+  PERFORM dw.ensure_fact_sales_partition(m)
+     FROM (SELECT DISTINCT to_date((order_date_key / 100)::text, 'YYYYMM') AS m FROM dw.fact_sales_heap) months;
+  INSERT INTO dw.fact_sales SELECT * FROM dw.fact_sales_heap;
+  DROP TABLE dw.fact_sales_heap;
+
+  CREATE INDEX IF NOT EXISTS ix_fact_sales_dates ON dw.fact_sales(order_date_key, ship_date_key);
+  CREATE INDEX IF NOT EXISTS ix_fact_sales_product ON dw.fact_sales(product_key);
+  CREATE INDEX IF NOT EXISTS ix_fact_sales_customer ON dw.fact_sales(customer_key);
+  -- criado por 01_tables.sql na tabela antiga e removido com ela (exportação Parquet incremental)
+  CREATE INDEX IF NOT EXISTS ix_fact_sales_created_at ON dw.fact_sales USING brin (created_at);
+END;
+$$;
@@ -0,0 +1,14 @@
+-- Modo pushdown do ETL (etl/pushdown.py): o DW lê o OLTP diretamente via dblink.
+-- Necessário apenas com ETL_PUSHDOWN=1 (ou pushdown=True nos loaders).
+CREATE EXTENSION IF NOT EXISTS dblink;
+
+-- Servidor do OLTP para o dblink (ETL_PUSHDOWN_SERVER, default oltp_pushdown). As credenciais ficam no
+-- user mapping, no catálogo; o ETL cita só o nome do servidor nas consultas, que assim não expõem a senha
+-- em pg_stat_activity, nos logs de comandos ou em mensagens de erro. Ajuste e rode uma vez, como dono do DW:
+--
+--   CREATE SERVER oltp_pushdown FOREIGN DATA WRAPPER dblink_fdw
+--     OPTIONS (host 'localhost', port '5432', dbname 'oltp_adventureworks');
+--   CREATE USER MAPPING FOR CURRENT_USER SERVER oltp_pushdown
+--     OPTIONS (user 'etl_reader', password '...');
+--
+-- (para não gravar a senha em log_statement, desligue-o na sessão: SET log_statement = 'none')